@@ -1,45 +1,144 @@
-import json
+import numpy as np
+import orjson
 from datetime import datetime, timezone
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pylatex import Document, Section, Subsection, Tabular, MultiColumn, MultiRow, Command
-from pylatex.utils import italic, NoEscape, bold
+from pylatex.utils import escape_latex
 from utils.ollama_client import OllamaClient
+import asyncio
 import concurrent.futures
+import logging
+import re
+import subprocess
+from string import Template
+
+logger = logging.getLogger(__name__)
+
+# Full LaTeX source of the PDF report; $date, $summary_rows and $details are filled in per report
+_LATEX_TEMPLATE = Template(r"""\documentclass{article}%
+\usepackage[T1]{fontenc}%
+\usepackage[utf8]{inputenc}%
+\usepackage{lmodern}%
+\usepackage{textcomp}%
+\usepackage{lastpage}%
+\usepackage{geometry}%
+\geometry{head=40pt,margin=0.7in,bottom=0.7in}%
+\usepackage{xcolor}%
+\usepackage{booktabs}%
+\usepackage{fancyhdr}%
+\usepackage{parskip}%
+\usepackage{graphicx}%
+\definecolor{sentinelblue}{HTML}{0D47A1}%
+\definecolor{lightgray}{HTML}{F5F5F5}%
+\pagestyle{fancy}%
+\fancyhf{}%
+\rhead{\small\textit{SentinelPay Analysis}}%
+\lhead{\small\textit{PCI-DSS Compliance Report}}%
+\cfoot{\thepage}%
+\title{PCI{-}DSS Compliance Violation Report}%
+\author{SentinelPay Analysis Engine}%
+\date{$date}%
+\begin{document}%
+\normalsize%
+\maketitle%
+\section*{Violations Summary}%
+\begin{tabular}{l l l}%
+\textbf{Transaction ID}&\textbf{Violation Type}&\textbf{Severity}\\%
+\hline%
+$summary_rows
+\hline%
+\end{tabular}
+
+\newpage%
+\section*{Detailed Violation Analysis}%
+$details
+\end{document}
+""")
+# Severity cell for Critical violations, shared by the summary table and the detailed section
+_CRITICAL_SEVERITY = r'\textbf{\textcolor{red}{Critical}}'
 
 class ComplianceReporter:
+    # Violation type -> PCI-DSS requirement
+    _PCI_REQUIREMENTS = {
+        "Full PAN stored": "PCI-DSS Requirement 3.4",
+        "CVV in log": "PCI-DSS Requirement 3.2",
+        "Expiration date stored": "PCI-DSS Requirement 3.2"
+    }
+    # Violation types mentioning any of these are Critical
+    _CRITICAL_TOKENS = ("PAN", "CVV")
+    # Paragraph breaks in LLM explanations
+    _PARA_RE = re.compile(r'\n{2,}')
+
     def __init__(self, transactions, violations, ollama_client=None):
         self.transactions = transactions
         self.violations = violations
         self.ollama_client = ollama_client
 
+    @property
+    def transactions(self):
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, transactions):
+        # Index by ID once so per-violation context lookups are O(1).
+        self._transactions = transactions
+        self._tx_index = {tx.get("transaction_id"): tx for tx in transactions}
+        self._risk_scores = None
+        self._detailed = None
+
+    @property
+    def violations(self):
+        return self._violations
+
+    @violations.setter
+    def violations(self, violations):
+        self._violations = violations
+        self._violation_tx_ids = {v['transaction_id'] for v in violations}
+        self._detailed = None
+
     def generate_daily_summary(self):
         """
         Generates a daily summary report.
         """
         total_transactions = len(self.transactions)
         total_violations = len(self.violations)
-        high_risk_transactions = [tx for tx in self.transactions if tx.get("risk_score", 0) > 5]
+        high_risk_transactions = int((self._get_risk_scores() > 5).sum())
         
         compliance_percentage = 0
         if total_transactions > 0:
-            compliant_transactions = total_transactions - len(set(v['transaction_id'] for v in self.violations))
+            compliant_transactions = total_transactions - len(self._violation_tx_ids)
             compliance_percentage = (compliant_transactions / total_transactions) * 100
 
         summary = {
             "report_date": datetime.now(timezone.utc).isoformat(),
             "total_transactions_processed": total_transactions,
             "total_violations_found": total_violations,
-            "high_risk_transactions_detected": len(high_risk_transactions),
+            "high_risk_transactions_detected": high_risk_transactions,
             "compliance_percentage": f"{compliance_percentage:.2f}%"
         }
         return summary
 
+    def _get_risk_scores(self):
+        """
+        Returns the risk scores of all transactions as a NumPy array, built once per transaction set.
+        """
+        if self._risk_scores is None:
+            self._risk_scores = np.fromiter(
+                (tx.get("risk_score", 0) for tx in self.transactions),
+                dtype=np.int32,
+                count=len(self.transactions)
+            )
+        return self._risk_scores
+
     def generate_detailed_violation_report(self):
         """
         Generates a detailed report for each violation.
+        The report is cached until transactions or violations are reassigned; treat it as read-only.
         """
+        if self._detailed is not None:
+            return self._detailed
+
         report = []
         for violation in self.violations:
             report.append({
@@ -52,178 +151,179 @@ class ComplianceReporter:
                 "recommended_action": "Implement remediation steps as per PCI-DSS guidelines.",
                 "severity_level": self._get_severity_level(violation.get("violation_type"))
             })
+        self._detailed = report
         return report
 
-    def generate_llm_enhanced_report(self):
+    def generate_llm_enhanced_report(self, max_workers=8):
         """
         Generates a detailed violation report with LLM-powered explanations.
         """
         if not self.ollama_client:
             raise ValueError("Ollama client not provided for LLM-enhanced reporting.")
 
-        report = self.generate_detailed_violation_report()
-        print(f"--- Debug: Generating LLM explanations for {len(report)} violations using ThreadPoolExecutor. ---")
+        # Copy the items so the LLM fields don't leak into the cached detailed report
+        report = [dict(item) for item in self.generate_detailed_violation_report()]
+        logger.debug("Generating LLM explanations for %d violations using ThreadPoolExecutor.", len(report))
 
-        def _get_explanation(item_index, violation_item):
-            print(f"--- Debug: Submitting explanation request for violation {item_index+1}/{len(report)} ---")
-            explanation = self.ollama_client.generate_compliance_explanation(violation_item)
-            return item_index, explanation
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            future_to_violation = {executor.submit(_get_explanation, i, item): i for i, item in enumerate(report)}
-            
-            for future in concurrent.futures.as_completed(future_to_violation):
-                item_index = future_to_violation[future]
-                try:
-                    original_index, explanation_result = future.result()
-                    if explanation_result is None:
-                        print(f"--- Debug: Failed to get explanation for violation {original_index+1}. ---")
-                        report[original_index]["llm_explanation"] = "Error: Could not generate explanation."
-                    else:
-                        print(f"--- Debug: Got explanation for violation {original_index+1}. ---")
-                        report[original_index]["llm_explanation"] = explanation_result
-                except Exception as exc:
-                    print(f"--- Debug: Violation {item_index+1} generated an exception: {exc} ---")
-                    report[item_index]["llm_explanation"] = f"Error: An exception occurred - {exc}"
-
-        print("--- Debug: Finished generating LLM explanations. ---")
+        # map() keeps the results in report order, so no index bookkeeping is needed
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for item, explanation in zip(report, executor.map(self._get_explanation, report)):
+                item["llm_explanation"] = explanation
+
+        logger.debug("Finished generating LLM explanations.")
+        return report
+
+    async def generate_llm_enhanced_report_async(self, max_concurrency=8):
+        """
+        Async counterpart of generate_llm_enhanced_report; awaits the client's async API directly, with at
+        most max_concurrency explanation requests in flight. The caller owns the event loop and should
+        await ollama_client.aclose() before it ends.
+        """
+        if not self.ollama_client:
+            raise ValueError("Ollama client not provided for LLM-enhanced reporting.")
+
+        report = [dict(item) for item in self.generate_detailed_violation_report()]
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def explain(item):
+            async with semaphore:
+                return await self._a_get_explanation(item)
+
+        explanations = await asyncio.gather(*(explain(item) for item in report))
+        for item, explanation in zip(report, explanations):
+            item["llm_explanation"] = explanation
         return report
 
+    def _get_explanation(self, violation_item):
+        """
+        Requests the LLM explanation for one report item, returning an error message instead of raising.
+        """
+        try:
+            explanation = self.ollama_client.generate_compliance_explanation(violation_item)
+        except Exception as exc:
+            return f"Error: An exception occurred - {exc}"
+        if explanation is None:
+            return "Error: Could not generate explanation."
+        return explanation
+
+    async def _a_get_explanation(self, violation_item):
+        """
+        Async counterpart of _get_explanation.
+        """
+        try:
+            explanation = await self.ollama_client.a_generate_compliance_explanation(violation_item)
+        except Exception as exc:
+            return f"Error: An exception occurred - {exc}"
+        if explanation is None:
+            return "Error: Could not generate explanation."
+        return explanation
+
     def _get_transaction_context(self, transaction_id):
         """
         Retrieves the context of a transaction given its ID.
         """
         if not transaction_id:
             return "No transaction ID provided."
-        for tx in self.transactions:
-            if tx.get("transaction_id") == transaction_id:
-                return f"Transaction Amount: {tx.get('amount')}, Cardholder: {tx['cardholder_details'].get('name')}"
-        return f"Transaction with ID '{transaction_id}' not found."
+        tx = self._tx_index.get(transaction_id)
+        if tx is None:
+            return f"Transaction with ID '{transaction_id}' not found."
+        return f"Transaction Amount: {tx.get('amount')}, Cardholder: {tx['cardholder_details'].get('name')}"
 
     def _get_pci_requirement(self, violation_type):
         """
         Maps a violation type to a PCI-DSS requirement.
         """
-        mapping = {
-            "Full PAN stored": "PCI-DSS Requirement 3.4",
-            "CVV in log": "PCI-DSS Requirement 3.2",
-            "Expiration date stored": "PCI-DSS Requirement 3.2"
-        }
-        return mapping.get(violation_type, "N/A")
+        return self._PCI_REQUIREMENTS.get(violation_type, "N/A")
 
     def _get_severity_level(self, violation_type):
         """
         Determines the severity level of a violation.
         """
-        if "PAN" in violation_type or "CVV" in violation_type:
-            return "Critical"
-        return "High"
+        return "Critical" if any(token in violation_type for token in self._CRITICAL_TOKENS) else "High"
 
     def save_as_json(self, data, filename):
         """
-        Saves the given data as a JSON file.
+        Saves the given data as a JSON file and returns the serialized bytes, so callers can reuse them.
         """
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+        with open(filename, 'wb') as f:
+            f.write(payload)
         print(f"Report saved to {filename}")
+        return payload
 
-    def save_as_latex_pdf(self, report_data, filename):
+    def save_as_ndjson(self, records, filename):
         """
-        Saves the given data as a stylish PDF file using LaTeX.
+        Streams records to a newline-delimited JSON file, one object per line.
+        Accepts any iterable, so large reports never need to be held in memory as a whole.
         """
-        geometry_options = {
-            "head": "40pt",
-            "margin": "0.7in",
-            "bottom": "0.7in",
-        }
-        doc = Document(geometry_options=geometry_options, documentclass="article")
-
-        # Preamble
-        doc.preamble.append(NoEscape(r'\usepackage[T1]{fontenc}'))
-        doc.preamble.append(NoEscape(r'\usepackage{xcolor}'))
-        doc.preamble.append(NoEscape(r'\usepackage{booktabs}'))
-        doc.preamble.append(NoEscape(r'\usepackage{fancyhdr}'))
-        doc.preamble.append(NoEscape(r'\usepackage{parskip}'))
-        doc.preamble.append(NoEscape(r'\usepackage{graphicx}'))
-        doc.preamble.append(NoEscape(r'\definecolor{sentinelblue}{HTML}{0D47A1}'))
-        doc.preamble.append(NoEscape(r'\definecolor{lightgray}{HTML}{F5F5F5}'))
-        doc.preamble.append(NoEscape(r'\pagestyle{fancy}'))
-        doc.preamble.append(NoEscape(r'\fancyhf{}'))
-        doc.preamble.append(NoEscape(r'\rhead{\small\textit{SentinelPay Analysis}}'))
-        doc.preamble.append(NoEscape(r'\lhead{\small\textit{PCI-DSS Compliance Report}}'))
-        doc.preamble.append(NoEscape(r'\cfoot{\thepage}'))
-        
-        # Title
-        doc.preamble.append(Command('title', 'PCI-DSS Compliance Violation Report'))
-        doc.preamble.append(Command('author', 'SentinelPay Analysis Engine'))
-        doc.preamble.append(Command('date', datetime.now(timezone.utc).strftime('%B %d, %Y')))
-        doc.append(NoEscape(r'\maketitle'))
+        with open(filename, 'wb') as f:
+            for record in records:
+                f.write(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+        print(f"Report saved to {filename}")
 
+    def save_as_latex_pdf(self, report_data, filename, debug=False):
+        """
+        Saves the given data as a stylish PDF file using LaTeX.
+        With debug=True the generated .tex source is also printed.
+        """
         # Summary Table
-        with doc.create(Section('Violations Summary', numbering=False)):
-            with doc.create(Tabular(r'l l l')) as table:
-                table.add_row(['Transaction ID', 'Violation Type', 'Severity'], mapper=bold)
-                table.add_hline()
-                for item in report_data:
-                    severity = item.get("severity_level", "N/A")
-                    if severity == "Critical":
-                        row = [item.get("transaction_id"), item.get("violation_type"), NoEscape(r'\textbf{\textcolor{red}{' + severity + '}}')]
-                    else:
-                        row = [item.get("transaction_id"), item.get("violation_type"), severity]
-                    table.add_row(row)
-                table.add_hline()
-
-        doc.append(NoEscape(r'\newpage'))
+        summary_rows = []
+        for item in report_data:
+            severity = item.get("severity_level", "N/A")
+            severity_cell = _CRITICAL_SEVERITY if severity == "Critical" else escape_latex(severity)
+            summary_rows.append(
+                f'{escape_latex(item.get("transaction_id"))}&{escape_latex(item.get("violation_type"))}&{severity_cell}\\\\%'
+            )
 
         # Detailed Explanations
-        with doc.create(Section('Detailed Violation Analysis', numbering=False)):
-            for item in report_data:
-                with doc.create(Subsection(f'Transaction: {item.get("transaction_id")}', numbering=False)):
-                    doc.append(bold("Violation Type: "))
-                    doc.append(item.get("violation_type"))
-                    doc.append(NoEscape(r'\\'))
-                    doc.append(bold("Severity: "))
-                    if item.get("severity_level") == "Critical":
-                         doc.append(NoEscape(r'\textbf{\textcolor{red}{Critical}}'))
-                    else:
-                        doc.append(item.get("severity_level", "N/A"))
-                    doc.append(NoEscape(r'\\'))
-                    doc.append(bold("PCI Requirement: "))
-                    doc.append(item.get("pci_requirement"))
-                    
-                    doc.append(NoEscape(r'\vspace{4mm}'))
-                    doc.append(bold("LLM Explanation:"))
-                    
-                    # Clean up the LLM explanation
-                    explanation = item.get("llm_explanation", "No explanation provided.")
-                    explanation_parts = explanation.split('\n\n')
-                    
-                    for part in explanation_parts:
-                        if ':' in part:
-                            title, content = part.split(':', 1)
-                            doc.append(NoEscape(r'\vspace{2mm}'))
-                            doc.append(italic(title.strip() + ":"))
-                            doc.append(content.strip())
-                        else:
-                            doc.append(part.strip())
-                    
-                    doc.append(NoEscape(r'\vspace{5mm}\hrule'))
+        details = []
+        for item in report_data:
+            details.append(r'\subsection*{Transaction: ' + escape_latex(item.get("transaction_id")) + '}%')
+            details.append(r'\textbf{Violation Type: }' + escape_latex(item.get("violation_type")) + r'\\%')
+            severity = item.get("severity_level", "N/A")
+            severity_cell = _CRITICAL_SEVERITY if severity == "Critical" else escape_latex(severity)
+            details.append(r'\textbf{Severity: }' + severity_cell + r'\\%')
+            details.append(r'\textbf{PCI Requirement: }' + escape_latex(item.get("pci_requirement")) + '%')
+            details.append(r'\vspace{4mm}\textbf{LLM Explanation:}%')
+
+            # Clean up the LLM explanation
+            explanation = item.get("llm_explanation", "No explanation provided.")
+            for part in self._PARA_RE.split(explanation):
+                title, colon, content = part.partition(':')
+                if colon:
+                    details.append(r'\vspace{2mm}\textit{' + escape_latex(title.strip()) + ':}%')
+                    details.append(escape_latex(content.strip()) + '%')
+                else:
+                    details.append(escape_latex(part.strip()) + '%')
+
+            details.append(r'\vspace{5mm}\hrule')
+            details.append('')
+
+        tex = _LATEX_TEMPLATE.substitute(
+            date=datetime.now(timezone.utc).strftime('%B %d, %Y'),
+            summary_rows="\n".join(summary_rows),
+            details="\n".join(details),
+        )
 
         try:
-            print(f"--- Debug: Generating .tex file: {filename}.tex ---")
-            # generate_tex will save the .tex file
-            doc.generate_tex(filename)
-            print(f"--- Debug: {filename}.tex file created. ---")
+            logger.debug("Generating .tex file: %s.tex", filename)
+            with open(f"{filename}.tex", "w") as f:
+                f.write(tex)
+            logger.debug("%s.tex file created.", filename)
 
-            # Read and print the content of the .tex file
-            with open(f"{filename}.tex", "r") as f:
+            if debug:
                 print(f"--- Debug: Content of {filename}.tex ---")
-                print(f.read())
+                print(tex)
                 print("--- End of .tex content ---")
 
-            print(f"--- Debug: Calling generate_pdf for {filename}.pdf ---")
-            doc.generate_pdf(filename, clean_tex=False)
+            logger.debug("Calling pdflatex for %s.pdf", filename)
+            output_dir = os.path.dirname(os.path.abspath(filename))
+            subprocess.run(
+                ["pdflatex", "-interaction=nonstopmode", f"-output-directory={output_dir}", f"{filename}.tex"],
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
             print(f"Stylish LaTeX PDF report saved to {filename}.pdf")
         except Exception as e:
             print(f"Could not generate PDF. Ensure you have a LaTeX distribution (like MiKTeX or TeX Live) installed and in your system's PATH. Error: {e}")
-
@@ -3,33 +3,56 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import re
+import asyncio
 import hashlib
-import json
+import logging
+import threading
+from functools import lru_cache
+import orjson
 from utils.ollama_client import OllamaClient
 
+logger = logging.getLogger(__name__)
+
+# Joins logs for batch scanning; never matched by the PAN regex
+_BATCH_SEPARATOR = '\x00'
+
+@lru_cache(maxsize=4096)
+def _sha256_hex(pan):
+    # Bounded cache: repeated PANs in a batch are hashed once without keeping every PAN in memory.
+    return hashlib.sha256(pan.encode('utf-8')).hexdigest()
+
 class DataSanitizer:
+    # str.translate table that deletes every non-digit ASCII character (spaces, dashes, ...)
+    _KEEP_DIGITS = dict.fromkeys(c for c in range(128) if not chr(c).isdigit())
+
     def __init__(self, mode='regex', ollama_client=None, violation_log_file='violations.log'):
         self.mode = mode
         if self.mode == 'ollama' and not ollama_client:
             raise ValueError("Ollama client must be provided for 'ollama' mode.")
         self.ollama_client = ollama_client
         self.violation_log_file = violation_log_file
+        # Opened on the first violation and kept open; batches may log from several threads
+        self._log_fh = None
+        self._log_lock = threading.Lock()
 
         # Regex to find potential PANs (13-19 digits, with optional spaces or dashes)
         self.pan_regex = re.compile(r'\b(?:\d[ -]*?){13,19}\b')
-        self.card_patterns = {
-            "Visa": re.compile(r'^4\d{12}(?:\d{3})?$'),
-            "Mastercard": re.compile(r'^5[1-5]\d{14}$'),
-            "Amex": re.compile(r'^3[47]\d{13}$'),
-            "Discover": re.compile(r'^6(?:011|5\d{2})\d{12}$'),
-            "JCB": re.compile(r'^(?:2131|1800|35\d{3})\d{11}$'),
-        }
+        # Card brands as one anchored alternation; the matching group's name is the card type
+        self.card_pattern = re.compile(
+            r'^(?:(?P<Visa>4\d{12}(?:\d{3})?)'
+            r'|(?P<Mastercard>5[1-5]\d{14})'
+            r'|(?P<Amex>3[47]\d{13})'
+            r'|(?P<Discover>6(?:011|5\d{2})\d{12})'
+            r'|(?P<JCB>(?:2131|1800|35\d{3})\d{11}))$'
+        )
+        # Repeated PAN candidates (same card across many logs) skip cleanup, classification and hashing
+        self._classify_candidate = lru_cache(maxsize=4096)(self._clean_and_classify)
 
     def mask_pan(self, pan):
         """
         Masks a PAN, keeping the first 6 and last 4 digits.
         """
-        pan_digits = "".join(filter(str.isdigit, pan))
+        pan_digits = pan.translate(self._KEEP_DIGITS)
         if 13 <= len(pan_digits) <= 19:
             return f"{pan_digits[:6]}{'*' * (len(pan_digits) - 10)}{pan_digits[-4:]}"
         return pan
@@ -38,17 +61,15 @@ class DataSanitizer:
         """
         Identifies the card type based on the PAN.
         """
-        pan_digits = "".join(filter(str.isdigit, pan))
-        for card_type, pattern in self.card_patterns.items():
-            if pattern.match(pan_digits):
-                return card_type
-        return "Unknown"
+        pan_digits = pan.translate(self._KEEP_DIGITS)
+        match = self.card_pattern.match(pan_digits)
+        return match.lastgroup if match else "Unknown"
 
     def create_audit_hash(self, pan):
         """
         Creates a SHA-256 hash of the PAN for auditing purposes.
         """
-        return hashlib.sha256(pan.encode()).hexdigest()
+        return _sha256_hex(pan)
 
     def sanitize_transaction(self, transaction_log):
         """
@@ -66,34 +87,127 @@ class DataSanitizer:
         else: # regex mode
             return self._sanitize_with_regex(transaction_log)
 
+    def sanitize_batch(self, transaction_logs):
+        """
+        Sanitizes a list of transaction log entries, returning results in the same order.
+        """
+        if not transaction_logs:
+            return []
+        if self.mode == 'ollama':
+            return self._sanitize_batch_with_ollama(transaction_logs)
+
+        # Scan the whole batch in a single regex pass. The separator can't be part of a PAN match,
+        # so matches never span two logs; fall back to per-log scanning if a log contains it.
+        buffer = _BATCH_SEPARATOR.join(transaction_logs)
+        if buffer.count(_BATCH_SEPARATOR) != len(transaction_logs) - 1:
+            return [self._sanitize_with_regex(log) for log in transaction_logs]
+        return self.pan_regex.sub(self._mask_match, buffer).split(_BATCH_SEPARATOR)
+
+    def _sanitize_batch_with_ollama(self, transaction_logs):
+        """
+        Sanitizes a batch of logs with one Ollama request, falling back to one request per log
+        if the batched response can't be used.
+        """
+        structured_responses = self.ollama_client.process_transactions_batch(transaction_logs)
+        if structured_responses is None:
+            return [self.sanitize_transaction(log) for log in transaction_logs]
+        return self._collect_batch_responses(structured_responses)
+
+    async def sanitize_batch_async(self, transaction_logs):
+        """
+        Async counterpart of sanitize_batch. In 'ollama' mode the batch request is awaited on the
+        client's AsyncClient when it has one; otherwise the sync path runs in a worker thread.
+        """
+        if self.mode != 'ollama' or not transaction_logs:
+            return self.sanitize_batch(transaction_logs)
+        if not hasattr(self.ollama_client, 'a_process_transactions_batch'):
+            return await asyncio.to_thread(self._sanitize_batch_with_ollama, transaction_logs)
+
+        structured_responses = await self.ollama_client.a_process_transactions_batch(transaction_logs)
+        if structured_responses is None:
+            return await asyncio.to_thread(lambda: [self.sanitize_transaction(log) for log in transaction_logs])
+        return self._collect_batch_responses(structured_responses)
+
+    def _collect_batch_responses(self, structured_responses):
+        """
+        Logs the violations of a batched response and returns its sanitized logs in order.
+        """
+        sanitized_logs = []
+        for structured_response in structured_responses:
+            violations = structured_response.get("violations")
+            if violations:
+                self._log_violations(violations)
+            sanitized_logs.append(structured_response.get("sanitized_log"))
+        return sanitized_logs
+
     def _sanitize_with_regex(self, transaction_log):
         """
         Sanitizes a single transaction log entry using regex.
         """
-        sanitized_log = transaction_log
-        pans_found = self.pan_regex.findall(transaction_log)
-        
-        for pan in pans_found:
-            cleaned_pan = "".join(filter(str.isdigit, pan))
-            if not (13 <= len(cleaned_pan) <= 19):
-                continue
-
-            card_type = self.get_card_type(cleaned_pan)
-            if card_type == "Unknown":
-                continue
-
-            masked_pan = self.mask_pan(cleaned_pan)
-            audit_hash = self.create_audit_hash(cleaned_pan)
-            
-            sanitized_log = sanitized_log.replace(pan, masked_pan)
-            
-            print(f"Detected and masked PAN. Audit Hash: {audit_hash}, Card Type: {card_type}")
-
-        return sanitized_log
+        return self.pan_regex.sub(self._mask_match, transaction_log)
+
+    def _mask_match(self, match):
+        """
+        Returns the masked replacement for a PAN candidate match, or the match unchanged if it is not a valid PAN.
+        """
+        pan = match.group(0)
+        result = self._classify_candidate(pan)
+        if result is None:
+            return pan
+
+        masked_pan, audit_hash, card_type = result
+        logger.debug("Detected and masked PAN. Audit Hash: %s, Card Type: %s", audit_hash, card_type)
+
+        return masked_pan
+
+    def _clean_and_classify(self, candidate):
+        """
+        Cleans a PAN candidate in one pass and classifies it.
+        Returns (masked_pan, audit_hash, card_type), or None if the candidate is not a valid PAN.
+        """
+        cleaned_pan = candidate.translate(self._KEEP_DIGITS)
+        if not cleaned_pan.isascii():
+            # The regex's \d also matches other scripts' digits; map them to ASCII so they are masked and hashed alike
+            cleaned_pan = ''.join(str(int(c)) for c in cleaned_pan if c.isdecimal())
+        if not (13 <= len(cleaned_pan) <= 19):
+            return None
+
+        card_match = self.card_pattern.match(cleaned_pan)
+        if not card_match:
+            return None
+
+        return self.mask_pan(cleaned_pan), self.create_audit_hash(cleaned_pan), card_match.lastgroup
         
+    def log_violation(self, violation):
+        """
+        Appends one violation to the violation log as a JSON line.
+        Writes are buffered; call close() before reading the log.
+        """
+        if self._log_fh is None:
+            with self._log_lock:
+                if self._log_fh is None:
+                    self._log_fh = open(self.violation_log_file, 'ab')
+        self._log_fh.write(orjson.dumps(violation, option=orjson.OPT_APPEND_NEWLINE))
+
+    def close(self):
+        """
+        Flushes and closes the violation log. It is reopened by the next logged violation.
+        """
+        with self._log_lock:
+            if self._log_fh is not None:
+                self._log_fh.close()
+                self._log_fh = None
+
+    def clear_violation_log(self):
+        """
+        Closes and truncates the violation log, so a reused sanitizer starts each run with an empty log.
+        """
+        self.close()
+        with self._log_lock:
+            open(self.violation_log_file, 'wb').close()
+
     def _log_violations(self, violations):
-        with open(self.violation_log_file, 'a') as f:
-            for violation in violations:
-                f.write(json.dumps(violation) + '\n')
+        for violation in violations:
+            self.log_violation(violation)
 
 
@@ -1,11 +1,21 @@
 from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+import bisect
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.ollama_client import OllamaClient
+from agents.risk_kernels import score_batch
 import json
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 class RiskAnalyzer:
+    # Seconds a transaction may arrive behind the newest one seen for its cardholder and still be counted exactly
+    _REORDER_WINDOW = 24 * 3600
+
     def __init__(self, ollama_client=None):
         self.risk_rules = {
             "high_transaction_value": {"threshold": 1000, "score": 3},
@@ -13,8 +23,24 @@ class RiskAnalyzer:
             "unusual_country": {"banned_countries": ["US", "AU"], "score": 5},
         }
         self.transaction_history = {}
+        # Per-cardholder epoch-second timestamps, kept sorted, for the short-period rule
+        self._recent_timestamps = defaultdict(list)
         self.ollama_client = ollama_client
 
+        # Countries are mapped to small integer IDs so the banned check is a single mask lookup.
+        # Changing banned_countries after construction is not reflected in the mask.
+        banned_countries = self.risk_rules["unusual_country"]["banned_countries"]
+        self._country_ids = {country: i for i, country in enumerate(banned_countries)}
+        self._banned_mask = np.zeros(max(8, 2 * len(banned_countries)), dtype=bool)
+        self._banned_mask[:len(banned_countries)] = True
+
+    def reset(self):
+        """
+        Forgets all transaction history, so a reused analyzer scores each run independently.
+        """
+        self.transaction_history = {}
+        self._recent_timestamps.clear()
+
     def calculate_risk_score(self, transaction):
         """
         Calculates a risk score for a given transaction based on a set of rules.
@@ -24,21 +50,91 @@ class RiskAnalyzer:
         # Rule: High transaction value
         if transaction["amount"] > self.risk_rules["high_transaction_value"]["threshold"]:
             risk_score += self.risk_rules["high_transaction_value"]["score"]
-            print(f"Risk rule triggered: High transaction value (>${self.risk_rules['high_transaction_value']['threshold']})")
+            logger.debug("Risk rule triggered: High transaction value (>$%s)", self.risk_rules['high_transaction_value']['threshold'])
 
         # Rule: Multiple transactions in a short period
         self._update_transaction_history(transaction)
         if self._check_multiple_transactions(transaction):
             risk_score += self.risk_rules["multiple_transactions_short_period"]["score"]
-            print(f"Risk rule triggered: Multiple transactions in a short period")
+            logger.debug("Risk rule triggered: Multiple transactions in a short period")
 
         # Rule: Unusual country
-        if transaction["merchant_details"]["country"] not in self.risk_rules["unusual_country"]["banned_countries"]:
+        country_id = self._country_id(transaction["merchant_details"]["country"])
+        if not self._banned_mask[country_id]:
             risk_score += self.risk_rules["unusual_country"]["score"]
-            print(f"Risk rule triggered: Unusual country ({transaction['merchant_details']['country']})")
+            logger.debug("Risk rule triggered: Unusual country (%s)", transaction['merchant_details']['country'])
 
         return risk_score
 
+    def score_many(self, transactions):
+        """
+        Calculates rule-based risk scores for a batch of transactions in one vectorized pass.
+        Equivalent to calling calculate_risk_score on each transaction in order.
+        """
+        rules = self.risk_rules
+        cardholder_ids = {}
+        rows = []  # (cardholder_id, timestamp, amount, country_id)
+
+        # Earlier history only counts towards the short-period rule; it is not re-scored.
+        for transaction in transactions:
+            cardholder = transaction["cardholder_details"]["name"]
+            if cardholder not in cardholder_ids:
+                cardholder_ids[cardholder] = len(cardholder_ids)
+                for timestamp in self._recent_timestamps.get(cardholder, ()):
+                    rows.append((cardholder_ids[cardholder], timestamp, 0, 0))
+        history_len = len(rows)
+
+        for transaction in transactions:
+            rows.append((
+                cardholder_ids[transaction["cardholder_details"]["name"]],
+                self._to_epoch(transaction["timestamp"]),
+                transaction["amount"],
+                self._country_id(transaction["merchant_details"]["country"])
+            ))
+
+        ids, timestamps, amounts, country_ids = zip(*rows) if rows else ((), (), (), ())
+        scores = score_batch(
+            amounts=np.asarray(amounts, dtype=np.float64),
+            country_ids=np.asarray(country_ids, dtype=np.int64),
+            banned_mask=self._banned_mask,
+            timestamps=np.asarray(timestamps, dtype=np.float64),
+            cardholder_ids=np.asarray(ids, dtype=np.int64),
+            thresh=rules["high_transaction_value"]["threshold"],
+            period=rules["multiple_transactions_short_period"]["period"].total_seconds(),
+            count_limit=rules["multiple_transactions_short_period"]["count"],
+            high_value_score=rules["high_transaction_value"]["score"],
+            multiple_tx_score=rules["multiple_transactions_short_period"]["score"],
+            unusual_country_score=rules["unusual_country"]["score"],
+        )
+
+        for transaction in transactions:
+            self._update_transaction_history(transaction)
+        for cardholder in cardholder_ids:
+            self._expire_timestamps(cardholder)
+        return scores[history_len:].tolist()
+
+    def _country_id(self, country):
+        """
+        Returns the integer ID of a country, assigning a new (non-banned) ID on first sight.
+        """
+        country_id = self._country_ids.get(country)
+        if country_id is None:
+            country_id = self._country_ids[country] = len(self._country_ids)
+            if country_id >= len(self._banned_mask):
+                grown = np.zeros(2 * len(self._banned_mask), dtype=bool)
+                grown[:len(self._banned_mask)] = self._banned_mask
+                self._banned_mask = grown
+        return country_id
+
+    @staticmethod
+    def _to_epoch(timestamp):
+        """
+        Converts a datetime or ISO 8601 string to seconds since the epoch.
+        """
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        return timestamp.timestamp()
+
     def _update_transaction_history(self, transaction):
         """
         Updates the transaction history for a given cardholder.
@@ -48,19 +144,38 @@ class RiskAnalyzer:
             self.transaction_history[cardholder] = []
         self.transaction_history[cardholder].append(transaction)
 
+        # Transactions can arrive out of timestamp order, so insert in sorted position (usually at the end)
+        recent = self._recent_timestamps[cardholder]
+        timestamp = self._to_epoch(transaction["timestamp"])
+        if not recent or timestamp >= recent[-1]:
+            recent.append(timestamp)
+        else:
+            bisect.insort(recent, timestamp)
+
+    def _expire_timestamps(self, cardholder):
+        """
+        Drops timestamps too old to fall in the short-period window of any later transaction. Transactions are
+        allowed to arrive up to _REORDER_WINDOW seconds behind the newest one seen; later stragglers may be
+        undercounted.
+        """
+        period = self.risk_rules["multiple_transactions_short_period"]["period"].total_seconds()
+        recent = self._recent_timestamps[cardholder]
+        del recent[:bisect.bisect_left(recent, recent[-1] - period - self._REORDER_WINDOW)]
+
     def _check_multiple_transactions(self, transaction):
         """
         Checks if a cardholder has made multiple transactions within a short period.
         """
         cardholder = transaction["cardholder_details"]["name"]
-        now = transaction["timestamp"]
-        period = self.risk_rules["multiple_transactions_short_period"]["period"]
+        period = self.risk_rules["multiple_transactions_short_period"]["period"].total_seconds()
         count = self.risk_rules["multiple_transactions_short_period"]["count"]
 
-        recent_transactions = [
-            t for t in self.transaction_history[cardholder] if now - t['timestamp'] <= period
-        ]
-        return len(recent_transactions) >= count
+        # _update_transaction_history has just inserted this transaction's epoch timestamp.
+        # Like the history scan it replaces, every earlier transaction no more than `period` older counts.
+        self._expire_timestamps(cardholder)
+        recent = self._recent_timestamps[cardholder]
+        now = self._to_epoch(transaction["timestamp"])
+        return len(recent) - bisect.bisect_left(recent, now - period) >= count
 
     def analyze_risk_with_llm(self, transaction):
         """
@@ -74,4 +189,26 @@ class RiskAnalyzer:
         
         return self.ollama_client.analyze_risk(transaction, history)
 
+    def analyze_risk_batch(self, transactions):
+        """
+        Analyzes the risk of several transactions with a single LLM request, falling back to
+        one request per transaction if the batched response can't be used.
+        """
+        if not self.ollama_client:
+            raise ValueError("Ollama client not provided.")
+
+        # Each cardholder's history is serialized once, however many of their transactions are in the batch
+        history_json = {}
+        for tx in transactions:
+            cardholder = tx["cardholder_details"]["name"]
+            if cardholder not in history_json:
+                history_json[cardholder] = self.ollama_client.serialize_history(self.transaction_history.get(cardholder, []))
+        histories = [history_json[tx["cardholder_details"]["name"]] for tx in transactions]
 
+        assessments = self.ollama_client.analyze_risk_batch(transactions, histories)
+        if assessments is None:
+            return [
+                self.ollama_client.analyze_risk_with_prepared_history(tx, history)
+                for tx, history in zip(transactions, histories)
+            ]
+        return assessments
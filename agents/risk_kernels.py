@@ -0,0 +1,50 @@
+import bisect
+
+import numpy as np
+
+
+def count_recent(timestamps, cardholder_ids, period):
+    """
+    For each row, counts the rows up to and including it (in input order) that belong to the
+    same cardholder and whose timestamp is no more than `period` seconds older.
+    """
+    counts = np.zeros(len(timestamps), dtype=np.int64)
+    if len(timestamps) == 0:
+        return counts
+
+    order = np.argsort(cardholder_ids, kind="stable")
+    boundaries = np.flatnonzero(np.diff(cardholder_ids[order])) + 1
+    for group in np.split(order, boundaries):
+        group_ts = timestamps[group]
+        if np.all(group_ts[1:] >= group_ts[:-1]):
+            # Input order is time order, so each row's window is the run of rows ending at it
+            counts[group] = np.arange(1, len(group_ts) + 1) - np.searchsorted(group_ts, group_ts - period, side="left")
+        else:
+            counts[group] = _count_recent_unordered(group_ts, period)
+    return counts
+
+
+def _count_recent_unordered(group_ts, period):
+    """
+    count_recent for one cardholder whose timestamps are out of order: keeps the timestamps seen so far
+    sorted and counts the ones within `period` of each row with a binary search.
+    """
+    counts = np.empty(len(group_ts), dtype=np.int64)
+    seen = []
+    for i, timestamp in enumerate(group_ts.tolist()):
+        bisect.insort(seen, timestamp)
+        counts[i] = len(seen) - bisect.bisect_left(seen, timestamp - period)
+    return counts
+
+
+def score_batch(amounts, country_ids, banned_mask, timestamps, cardholder_ids, thresh, period, count_limit,
+                high_value_score, multiple_tx_score, unusual_country_score):
+    """
+    Applies the rule-based risk scoring to a whole batch of transactions stored as parallel arrays.
+    `banned_mask[country_id]` is True for countries exempt from the unusual-country rule.
+    """
+    recent = count_recent(timestamps, cardholder_ids, period)
+    scores = np.where(amounts > thresh, high_value_score, 0)
+    scores += np.where(recent >= count_limit, multiple_tx_score, 0)
+    scores += unusual_country_score * (1 - banned_mask[country_ids])
+    return scores
@@ -1,9 +1,199 @@
 import streamlit as st
-import pandas as pd
 import json
+import hashlib
+import io
 import os
 from datetime import datetime
-from main import run_pipeline # Import the refactored pipeline function
+# pandas, numpy and the pipeline (agents, Ollama client) are imported where they are used,
+# so a cold start without an upload doesn't pay for them
+
+@st.cache_resource
+def _get_pipeline():
+    """
+    Imports the pipeline once per process and returns run_pipeline.
+    """
+    from main import run_pipeline
+    return run_pipeline
+
+def _payload_hash(transactions):
+    """
+    Returns a stable digest of the sanitized transactions, used as the cache key for the dashboard frame.
+    """
+    payload = json.dumps(transactions, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload).hexdigest()
+
+@st.cache_data(show_spinner=False)
+def _build_tx_df(payload_hash, _transactions):
+    """
+    Builds the dashboard DataFrame, with compact column dtypes, once per pipeline run instead of on every rerun.
+    Only payload_hash is part of the cache key; the leading underscore keeps Streamlit from hashing the list.
+    """
+    import numpy as np
+    import pandas as pd
+
+    df_transactions = pd.DataFrame(_transactions)
+
+    # Convert timestamp to datetime objects for filtering
+    if 'timestamp' in df_transactions.columns:
+        df_transactions['timestamp'] = pd.to_datetime(df_transactions['timestamp'], format='ISO8601', cache=True, utc=True)
+
+    # Scores are small integers, so int8 keeps the column compact for filtering and np.bincount
+    if 'risk_score' in df_transactions.columns:
+        df_transactions['risk_score'] = df_transactions['risk_score'].fillna(0).astype(np.int8)
+
+    if 'transaction_id' in df_transactions.columns:
+        df_transactions['transaction_id'] = df_transactions['transaction_id'].astype('string[pyarrow]')
+
+    # Merchant fields are flattened into categoricals; filters then only scan the distinct values
+    if 'merchant_details' in df_transactions.columns:
+        merchant_details = df_transactions['merchant_details']
+        df_transactions['merchant_name'] = merchant_details.map(
+            lambda x: x.get('name', '') if isinstance(x, dict) else ''
+        ).astype('category')
+        df_transactions['merchant_country'] = merchant_details.map(
+            lambda x: x.get('country', '') if isinstance(x, dict) else ''
+        ).astype('category')
+    return df_transactions
+
+def _read_upload(file_type, raw_bytes):
+    """
+    Parses an uploaded file. JSON is parsed with orjson into the records exactly as uploaded; CSV goes into
+    an Arrow-backed DataFrame whose rows run_pipeline converts to dicts per chunk, leaving out empty cells.
+    """
+    import orjson
+    import pandas as pd
+
+    if file_type == "application/json":
+        return orjson.loads(raw_bytes)
+    if file_type == "text/csv":
+        # The C parser leaves timestamps as strings; the pyarrow engine would turn them into Timestamps
+        return pd.read_csv(io.BytesIO(raw_bytes), dtype_backend='pyarrow')
+    return []
+
+class DegradedRunError(Exception):
+    """
+    Raised by cached_run_pipeline when some transactions failed to sanitize or fell back to rule-based
+    risk scoring (e.g. Ollama was down), so the run is not cached. `result` holds the pipeline's output.
+    """
+    def __init__(self, result):
+        super().__init__("Pipeline run was degraded; its result was not cached.")
+        self.result = result
+
+def _is_degraded(result, num_transactions):
+    """
+    Returns True if a pipeline result dropped transactions in sanitization or scored any without the LLM.
+    """
+    _, sanitized_transactions, _, _ = result
+    return len(sanitized_transactions) < num_transactions or any(
+        tx.get('risk_reasoning', '').startswith("Rule-based fallback") for tx in sanitized_transactions
+    )
+
+def _without_raw_logs(result):
+    """
+    Returns the pipeline result with each transaction's original_log left out. The raw log holds the full PAN
+    and any CVV, so it must not reach the on-disk cache; the dashboard only shows the sanitized fields.
+    """
+    reports, sanitized_transactions, violations, report_bytes = result
+    sanitized_transactions = [
+        {key: value for key, value in tx.items() if key != 'original_log'} for tx in sanitized_transactions
+    ]
+    return reports, sanitized_transactions, violations, report_bytes
+
+@st.cache_data(persist='disk', show_spinner=False)
+def cached_run_pipeline(upload_hash, file_type, _raw_bytes):
+    """
+    Runs the pipeline once per distinct upload, so re-processing the same file skips every LLM call,
+    also across app restarts. Returns None if the upload holds no transactions.
+    Degraded runs raise DegradedRunError instead, since Streamlit doesn't cache exceptions; a re-upload then
+    runs the pipeline again.
+    Reports go to streamlit_reports/<upload_hash>/ so cached report paths stay valid.
+    Raw logs are stripped from the result first, so no unmasked card data is persisted.
+    The progress bar is created in here: Streamlit replays elements created inside a cached function
+    on a cache hit, but can't replay calls on an element created outside it.
+    """
+    raw_transactions_data = _read_upload(file_type, _raw_bytes)
+    if len(raw_transactions_data) == 0:
+        return None
+
+    output_dir = os.path.join("streamlit_reports", upload_hash)
+    os.makedirs(output_dir, exist_ok=True)
+    progress = st.progress(0.0)
+    result = _get_pipeline()(raw_transactions_data, output_dir=output_dir, on_progress=progress.progress)
+    progress.empty()
+    result = _without_raw_logs(result)
+    if _is_degraded(result, len(raw_transactions_data)):
+        raise DegradedRunError(result)
+    return result
+
+@st.fragment
+def _dashboard_fragment(df_transactions, violations):
+    """
+    Renders the filters, violation alerts, risk chart and transaction table.
+    Widget changes in here rerun only this fragment, not the upload handling and frame building in main().
+    """
+    import numpy as np
+    import pandas as pd
+
+    # Advanced Features - Search & Filter
+    # Each filter contributes a boolean mask; the frame is sliced once at the end.
+    # Fragments can't write to the sidebar, so the filters live in the main area.
+    st.subheader("Search & Filter")
+    mask = np.ones(len(df_transactions), dtype=bool)
+
+    # Search by transaction ID
+    transaction_id_search = st.text_input("Search by Transaction ID")
+    if transaction_id_search:
+        mask &= df_transactions['transaction_id'].str.contains(transaction_id_search, case=False, na=False).to_numpy()
+
+    # Filter by risk score
+    risk_score_range = st.slider("Filter by Risk Score", 0, 100, (0, 100))
+    mask &= df_transactions['risk_score'].between(*risk_score_range).to_numpy()
+
+    # Date range selection
+    date_range = st.date_input("Filter by Date Range", [])
+    if len(date_range) == 2:
+        # Timestamps are UTC-aware, so the bounds must be too
+        start_date = pd.Timestamp(date_range[0], tz='UTC')
+        end_date = pd.Timestamp(date_range[1], tz='UTC')
+        mask &= df_transactions['timestamp'].between(start_date, end_date).to_numpy()
+
+    # Merchant filtering
+    merchant_filter = st.text_input("Filter by Merchant")
+    if merchant_filter:
+        # Assuming 'merchant_details' is a dictionary with a 'name' key
+        if 'merchant_name' in df_transactions.columns:
+            mask &= df_transactions['merchant_name'].str.contains(merchant_filter, case=False, regex=False, na=False).to_numpy(dtype=bool)
+        else:
+            st.warning("Merchant details not available for filtering.")
+
+    # df_transactions is shared across reruns via session_state; .loc returns a new frame, so it is never mutated
+    filtered_df_transactions = df_transactions.loc[mask]
+
+
+    # 3. Violation alerts
+    st.subheader("Violation Alerts")
+    if violations:
+        # Only display violations for transactions that are still in the filtered view
+        visible_ids = set(filtered_df_transactions['transaction_id'].to_numpy().tolist())
+        for i, violation in enumerate(violations if visible_ids else ()):
+            if violation.get('transaction_id') in visible_ids:
+                st.warning(f"Violation {i+1}: {violation.get('description', 'No description')} for transaction ID: {violation.get('transaction_id', 'N/A')}")
+    else:
+        st.info("No violations detected.")
+
+    # 4. Risk score visualization
+    st.subheader("Risk Score Distribution")
+    if not filtered_df_transactions.empty and 'risk_score' in filtered_df_transactions.columns:
+        counts = np.bincount(filtered_df_transactions['risk_score'].to_numpy(dtype=np.int8), minlength=11)
+        st.bar_chart(pd.Series(counts, index=np.arange(len(counts))))
+    else:
+        st.info("No risk score data available for visualization based on current filters.")
+
+    st.subheader("Sanitized Transactions Overview (Filtered)")
+    if not filtered_df_transactions.empty:
+        st.dataframe(filtered_df_transactions)
+    else:
+        st.info("No transactions match the current filter criteria.")
 
 def main():
     st.set_page_config(layout="wide")
@@ -16,6 +206,13 @@ def main():
         st.session_state.sanitized_transactions = None
     if 'violations' not in st.session_state:
         st.session_state.violations = None
+    if 'report_bytes' not in st.session_state:
+        st.session_state.report_bytes = {}
+    if 'payload_hash' not in st.session_state:
+        st.session_state.payload_hash = None
+    if 'df_transactions' not in st.session_state:
+        st.session_state.df_transactions = None
+        st.session_state.df_transactions_hash = None
 
     # Sidebar for navigation/options
     st.sidebar.title("Options")
@@ -25,27 +222,31 @@ def main():
 
     process_button = st.sidebar.button("Process Transactions")
 
+    # Cached results are kept across restarts; this forces the next run of every upload through the pipeline
+    if st.sidebar.button("Clear Cached Results"):
+        cached_run_pipeline.clear()
+        st.sidebar.info("Cached results cleared. Process the file again to re-run the pipeline.")
+
     if uploaded_file is not None and process_button:
         st.sidebar.success("File uploaded successfully!")
         
         file_details = {"filename": uploaded_file.name, "filetype": uploaded_file.type, "filesize": uploaded_file.size}
         st.sidebar.write(file_details)
 
-        raw_transactions_data = []
-        if uploaded_file.type == "application/json":
-            raw_transactions_data = json.load(uploaded_file)
-        elif uploaded_file.type == "text/csv":
-            df = pd.read_csv(uploaded_file)
-            raw_transactions_data = df.to_dict(orient='records')
-        
-        if raw_transactions_data:
-            with st.spinner('Processing transactions... This may take a while for LLM interactions.'):
-                # Ensure a temporary output directory exists for reports
-                output_dir = "streamlit_reports"
-                os.makedirs(output_dir, exist_ok=True)
-
-                st.session_state.reports, st.session_state.sanitized_transactions, st.session_state.violations = \
-                    run_pipeline(raw_transactions_data, output_dir=output_dir)
+        raw_bytes = uploaded_file.getvalue()
+        upload_hash = hashlib.blake2b(raw_bytes, digest_size=16).hexdigest()
+        with st.spinner('Processing transactions... This may take a while for LLM interactions.'):
+            try:
+                result = cached_run_pipeline(upload_hash, uploaded_file.type, raw_bytes)
+            except DegradedRunError as e:
+                result = e.result
+                st.warning("Some transactions could not be processed by the LLM, so these results were not cached. "
+                           "Process the file again once the Ollama server is available.")
+
+        if result is not None:
+            st.session_state.reports, st.session_state.sanitized_transactions, st.session_state.violations, \
+                st.session_state.report_bytes = result
+            st.session_state.payload_hash = _payload_hash(st.session_state.sanitized_transactions)
             st.success("Processing complete!")
         else:
             st.sidebar.error("Could not read transaction data from the uploaded file.")
@@ -54,78 +255,17 @@ def main():
     st.header("Transaction Dashboard")
 
     if st.session_state.sanitized_transactions:
-        df_transactions = pd.DataFrame(st.session_state.sanitized_transactions)
-        
-        # Convert timestamp to datetime objects for filtering
-        if 'timestamp' in df_transactions.columns:
-            df_transactions['timestamp'] = pd.to_datetime(df_transactions['timestamp'])
-        
-        filtered_df_transactions = df_transactions.copy()
-
-        # Advanced Features - Search & Filter
-        st.sidebar.header("Search & Filter")
-
-        # Search by transaction ID
-        transaction_id_search = st.sidebar.text_input("Search by Transaction ID")
-        if transaction_id_search:
-            filtered_df_transactions = filtered_df_transactions[
-                filtered_df_transactions['transaction_id'].str.contains(transaction_id_search, case=False, na=False)
-            ]
-
-        # Filter by risk score
-        risk_score_range = st.sidebar.slider("Filter by Risk Score", 0, 100, (0, 100))
-        filtered_df_transactions = filtered_df_transactions[
-            (filtered_df_transactions['risk_score'] >= risk_score_range[0]) & 
-            (filtered_df_transactions['risk_score'] <= risk_score_range[1])
-        ]
-
-        # Date range selection
-        date_range = st.sidebar.date_input("Filter by Date Range", [])
-        if len(date_range) == 2:
-            start_date = pd.to_datetime(date_range[0])
-            end_date = pd.to_datetime(date_range[1])
-            filtered_df_transactions = filtered_df_transactions[
-                (filtered_df_transactions['timestamp'] >= start_date) & 
-                (filtered_df_transactions['timestamp'] <= end_date)
-            ]
-
-        # Merchant filtering
-        merchant_filter = st.sidebar.text_input("Filter by Merchant")
-        if merchant_filter:
-            # Assuming 'merchant_details' is a dictionary with a 'name' key
-            if 'merchant_details' in filtered_df_transactions.columns:
-                filtered_df_transactions = filtered_df_transactions[
-                    filtered_df_transactions['merchant_details'].apply(
-                        lambda x: merchant_filter.lower() in x.get('name', '').lower() if isinstance(x, dict) else False
-                    )
-                ]
-            else:
-                st.sidebar.warning("Merchant details not available for filtering.")
-
-
-        # 3. Violation alerts
-        st.subheader("Violation Alerts")
-        if st.session_state.violations:
-            for i, violation in enumerate(st.session_state.violations):
-                # Only display violations for transactions that are still in the filtered view
-                if any(filtered_df_transactions['transaction_id'] == violation.get('transaction_id')):
-                    st.warning(f"Violation {i+1}: {violation.get('description', 'No description')} for transaction ID: {violation.get('transaction_id', 'N/A')}")
-        else:
-            st.info("No violations detected.")
-
-        # 4. Risk score visualization
-        st.subheader("Risk Score Distribution")
-        if not filtered_df_transactions.empty and 'risk_score' in filtered_df_transactions.columns:
-            risk_scores = filtered_df_transactions['risk_score'].value_counts().sort_index()
-            st.bar_chart(risk_scores)
-        else:
-            st.info("No risk score data available for visualization based on current filters.")
+        if st.session_state.payload_hash is None:
+            st.session_state.payload_hash = _payload_hash(st.session_state.sanitized_transactions)
+        # Kept in session_state so reruns reuse the same frame instead of copying it out of the cache
+        if st.session_state.df_transactions_hash != st.session_state.payload_hash:
+            st.session_state.df_transactions = _build_tx_df(
+                st.session_state.payload_hash, st.session_state.sanitized_transactions
+            )
+            st.session_state.df_transactions_hash = st.session_state.payload_hash
+        df_transactions = st.session_state.df_transactions
 
-        st.subheader("Sanitized Transactions Overview (Filtered)")
-        if not filtered_df_transactions.empty:
-            st.dataframe(filtered_df_transactions)
-        else:
-            st.info("No transactions match the current filter criteria.")
+        _dashboard_fragment(df_transactions, st.session_state.violations)
 
     else:
         st.info("Upload a transaction file and click 'Process Transactions' to see the dashboard.")
@@ -134,24 +274,24 @@ def main():
     st.sidebar.header("Download Reports")
     if st.session_state.reports:
         # Download JSON reports
-        if st.session_state.reports.get('daily_summary'):
+        if st.session_state.report_bytes.get('daily_summary'):
             st.sidebar.download_button(
                 label="Download Daily Summary (JSON)",
-                data=json.dumps(st.session_state.reports['daily_summary'], indent=2),
+                data=st.session_state.report_bytes['daily_summary'],
                 file_name="daily_summary.json",
                 mime="application/json"
             )
-        if st.session_state.reports.get('detailed_violation_report'):
+        if st.session_state.report_bytes.get('detailed_violation_report'):
             st.sidebar.download_button(
                 label="Download Detailed Violation Report (JSON)",
-                data=json.dumps(st.session_state.reports['detailed_violation_report'], indent=2),
+                data=st.session_state.report_bytes['detailed_violation_report'],
                 file_name="detailed_violation_report.json",
                 mime="application/json"
             )
-        if st.session_state.reports.get('llm_enhanced_report'):
+        if st.session_state.report_bytes.get('llm_enhanced_report'):
             st.sidebar.download_button(
                 label="Download LLM Enhanced Report (JSON)",
-                data=json.dumps(st.session_state.reports['llm_enhanced_report'], indent=2),
+                data=st.session_state.report_bytes['llm_enhanced_report'],
                 file_name="llm_enhanced_report.json",
                 mime="application/json"
             )
@@ -1,36 +1,79 @@
 import json
+import multiprocessing
+import os
 import random
-import uuid
-from datetime import datetime, timedelta
+import orjson
+from datetime import timedelta
 from faker import Faker
 
 fake = Faker()
 
-def create_fake_pan(faker_instance):
-    """Generate a fake Primary Account Number (PAN)."""
-    return faker_instance.credit_card_number()
+# Issuer prefixes and total PAN lengths (Visa, Mastercard, Amex, Discover)
+_PAN_FORMATS = [("4", 16), ("51", 16), ("55", 16), ("34", 15), ("37", 15), ("6011", 16)]
 
-def generate_transactions(num_transactions=1000):
-    """Generate a list of synthetic transactions."""
-    transactions = []
-    pan_to_last_tx = {}
+def _luhn(digits):
+    """Return the Luhn check digit for a list of payload digits."""
+    total = 0
+    # Doubling starts at the rightmost payload digit, since the check digit will follow it
+    for i, digit in enumerate(reversed(digits)):
+        if i % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return (10 - total % 10) % 10
 
-    for _ in range(num_transactions):
-        pan = create_fake_pan(fake)
-        is_violation = random.random() < 0.1  # 10% chance of a violation
-        is_suspicious = random.random() < 0.05 # 5% chance of suspicious activity
+def fast_pan(rng=random):
+    """Generate a fake Luhn-valid Primary Account Number (PAN) without going through Faker."""
+    prefix, length = rng.choice(_PAN_FORMATS)
+    digits = [int(d) for d in prefix]
+    digits += [rng.randint(0, 9) for _ in range(length - len(prefix) - 1)]
+    checksum = _luhn(digits)
+    return ''.join(map(str, digits)) + str(checksum)
+
+def _uuid4_from_bytes(raw):
+    """Format 16 random bytes as a version 4 UUID string."""
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) & 3]}{h[17:20]}-{h[20:]}"
+
+# Records generated per worker task
+_CHUNK_SIZE = 256
+
+def _generate_chunk(args):
+    """
+    Generate `count` independent transactions with their own seeded RNG and Faker state.
+    Returns (transaction, timestamp, is_suspicious) tuples; runs in a worker process.
+    """
+    seed, count = args
+    rng = random.Random(seed)
+    fake.seed_instance(seed)
+    # Bound methods looked up once instead of on every record
+    fake_name = fake.name
+    fake_company = fake.company
+    fake_city = fake.city
+    fake_country = fake.country
+    fake_dt = fake.date_time_this_year
+    # Entropy for every transaction ID in one read instead of one os.urandom call per uuid4()
+    entropy = os.urandom(16 * count)
+
+    records = []
+    for i in range(count):
+        pan = fast_pan(rng)
+        current_time = fake_dt()
+        is_violation = rng.random() < 0.1  # 10% chance of a violation
+        is_suspicious = rng.random() < 0.05 # 5% chance of suspicious activity
 
         # --- Create a base transaction ---
         transaction = {
-            "transaction_id": str(uuid.uuid4()),
+            "transaction_id": _uuid4_from_bytes(entropy[i * 16:(i + 1) * 16]),
             "pan": pan,
-            "cardholder_name": fake.name(),
-            "transaction_amount": round(random.uniform(5.0, 1500.0), 2),
-            "merchant_details": fake.company(),
-            "timestamp": fake.date_time_this_year().isoformat(),
+            "cardholder_name": fake_name(),
+            "transaction_amount": rng.randint(500, 150000) / 100,
+            "merchant_details": fake_company(),
+            "timestamp": current_time.isoformat(),
             "location_data": {
-                "city": fake.city(),
-                "country": fake.country(),
+                "city": fake_city(),
+                "country": fake_country(),
             }
         }
 
@@ -38,39 +81,60 @@ def generate_transactions(num_transactions=1000):
 
         # PCI-DSS Rule 3.2 Violation: Storing CVV
         if is_violation:
-            transaction["cvv"] = fake.credit_card_security_code()
+            transaction["cvv"] = ''.join(rng.choices('0123456789', k=3))
 
         # Suspicious Pattern: Unusually high transaction amount
         if is_suspicious:
-            transaction["transaction_amount"] = round(random.uniform(5000.0, 25000.0), 2)
+            transaction["transaction_amount"] = rng.randint(500000, 2500000) / 100
             transaction["suspicion_reason"] = "Unusually high transaction amount"
 
-        # Suspicious Pattern: Rapid transactions from different locations
-        if pan in pan_to_last_tx and not is_suspicious:
-            last_tx_time_str, last_location = pan_to_last_tx[pan]
-            last_tx_time = datetime.fromisoformat(last_tx_time_str)
-            current_time = datetime.fromisoformat(transaction["timestamp"])
-            current_location = transaction["location_data"]["country"]
+        records.append((transaction, current_time, is_suspicious))
+    return records
+
+def _flag_rapid_geo(records):
+    """
+    Flag pairs of consecutive transactions on the same PAN less than an hour apart from different countries.
+    Sorting by (PAN, timestamp) puts each PAN's transactions next to each other, so one linear walk suffices.
+    """
+    order = sorted(range(len(records)), key=lambda i: (records[i][0]["pan"], records[i][1]))
+    for prev_i, cur_i in zip(order, order[1:]):
+        previous, last_tx_time, _ = records[prev_i]
+        transaction, current_time, is_suspicious = records[cur_i]
+        if transaction["pan"] != previous["pan"] or is_suspicious:
+            continue
 
-            if (current_time - last_tx_time) < timedelta(hours=1) and current_location != last_location:
-                transaction["suspicion_reason"] = "Rapid transaction from a different geographic location"
-                # Also flag the previous transaction
-                for t in reversed(transactions):
-                    if t["pan"] == pan:
-                        t["suspicion_reason"] = "Rapid transaction followed by another from a different location"
-                        break
-        
-        pan_to_last_tx[pan] = (transaction["timestamp"], transaction["location_data"]["country"])
+        current_location = transaction["location_data"]["country"]
+        if (current_time - last_tx_time) < timedelta(hours=1) and current_location != previous["location_data"]["country"]:
+            transaction["suspicion_reason"] = "Rapid transaction from a different geographic location"
+            # Also flag the previous transaction
+            previous["suspicion_reason"] = "Rapid transaction followed by another from a different location"
 
+def generate_transactions(num_transactions=1000, processes=None):
+    """
+    Generate a list of synthetic transactions.
+    Records are generated in chunks on a process pool (`processes` defaults to the CPU count);
+    a single chunk is generated in-process.
+    """
+    chunks = [
+        (random.getrandbits(64), min(_CHUNK_SIZE, num_transactions - start))
+        for start in range(0, num_transactions, _CHUNK_SIZE)
+    ]
+    if len(chunks) > 1 and processes != 1:
+        with multiprocessing.Pool(processes) as pool:
+            chunk_records = pool.map(_generate_chunk, chunks)
+    else:
+        chunk_records = [_generate_chunk(chunk) for chunk in chunks]
+    records = [record for chunk in chunk_records for record in chunk]
 
-        transactions.append(transaction)
+    # Suspicious Pattern: Rapid transactions from different locations
+    _flag_rapid_geo(records)
 
-    return transactions
+    return [transaction for transaction, _, _ in records]
 
 def save_transactions_to_json(transactions, filename="transactions.json"):
     """Save transactions to a JSON file."""
-    with open(filename, "w") as f:
-        json.dump(transactions, f, indent=4)
+    with open(filename, "wb") as f:
+        f.write(orjson.dumps(transactions, option=orjson.OPT_INDENT_2))
 
 if __name__ == "__main__":
     num_records = 50
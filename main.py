@@ -1,7 +1,15 @@
+import asyncio
 import json
+import logging
+import math
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
+import orjson
+import pandas as pd
 
 # Add project root to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -11,44 +19,144 @@ from agents.risk_analyzer import RiskAnalyzer
 from agents.compliance_reporter import ComplianceReporter
 from utils.ollama_client import OllamaClient
 
-def run_pipeline(raw_transactions, output_dir='.'):
+logger = logging.getLogger("sentinelpay.pipeline")
+
+def _call_safely(func, arg):
     """
-    Main function to orchestrate the transaction processing pipeline.
+    Calls func(arg) and returns (result, None, seconds), or (None, exception, seconds) if it raised,
+    so one failed LLM call doesn't abort the rest of the pool.
     """
-    # Configuration
-    BATCH_SIZE = 100
-    VIOLATION_LOG_FILE = os.path.join(output_dir, 'violations.log')
+    start = time.perf_counter()
+    try:
+        return func(arg), None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
+
+async def _sanitize_chunks(sanitize, chunk_inputs, max_concurrency, on_chunk_done):
+    """
+    Awaits sanitize(chunk_logs) for every (chunk, chunk_logs) pair with at most `max_concurrency` requests
+    in flight. As each one finishes, on_chunk_done(chunk, chunk_logs, outcome) is called on the event loop's
+    thread, with outcome shaped like _call_safely's result.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(chunk, chunk_logs):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                outcome = (await sanitize(chunk_logs), None, time.perf_counter() - start)
+            except Exception as e:
+                outcome = (None, e, time.perf_counter() - start)
+        on_chunk_done(chunk, chunk_logs, outcome)
+
+    await asyncio.gather(*(run(chunk, chunk_logs) for chunk, chunk_logs in chunk_inputs))
 
-    # Initialize Ollama client and agents
-    ollama_client = OllamaClient()
-    data_sanitizer = DataSanitizer(mode='ollama', ollama_client=ollama_client, violation_log_file=VIOLATION_LOG_FILE)
+@lru_cache(maxsize=1)
+def get_ollama_client():
+    """
+    Returns the process-wide OllamaClient, so every run shares its HTTP connections, circuit breaker and caches.
+    """
+    return OllamaClient()
+
+@lru_cache(maxsize=16)
+def get_agents(violation_log_file):
+    """
+    Returns (ollama_client, data_sanitizer, risk_analyzer, compliance_reporter). The agents are built once per
+    violation log file and process, since the sanitizer keeps its log open; all of them share one client.
+    Callers must reset per-run state themselves; see run_pipeline.
+    """
+    ollama_client = get_ollama_client()
+    data_sanitizer = DataSanitizer(mode='ollama', ollama_client=ollama_client, violation_log_file=violation_log_file)
     risk_analyzer = RiskAnalyzer(ollama_client=ollama_client)
     compliance_reporter = ComplianceReporter(
         transactions=[],  # Will be populated later
         violations=[],    # Will be populated later
         ollama_client=ollama_client
     )
+    return ollama_client, data_sanitizer, risk_analyzer, compliance_reporter
+
+def _is_missing(value):
+    """
+    Returns True for the values pandas uses for an empty cell.
+    """
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and math.isnan(value))
 
-    print(f"Loaded {len(raw_transactions)} transactions.")
+def _chunk_records(raw_transactions, chunk):
+    """
+    Returns the transactions at the positions in `chunk` as a list. DataFrame rows are
+    converted to dicts here, so only one chunk at a time exists as Python objects.
+    Empty cells are left out, since a column only present in some rows is not part of the others.
+    """
+    if isinstance(raw_transactions, pd.DataFrame):
+        return [
+            {key: value for key, value in record.items() if not _is_missing(value)}
+            for record in raw_transactions.iloc[chunk.start:chunk.stop].to_dict(orient='records')
+        ]
+    return raw_transactions[chunk.start:chunk.stop]
+
+def run_pipeline(raw_transactions, output_dir='.', max_workers=8, on_progress=None):
+    """
+    Main function to orchestrate the transaction processing pipeline.
+    `raw_transactions` is a list of transaction logs or a DataFrame with one transaction per row.
+    Returns (reports, sanitized transactions, violations, serialized JSON reports keyed like `reports`).
+    `max_workers` bounds the number of concurrent LLM requests per stage.
+    `on_progress`, if given, is called from the calling thread with the completed fraction (0.0-1.0)
+    of the sanitization and risk stages, once per batch.
+    """
+    # Configuration
+    LLM_BATCH_SIZE = 8  # transactions per Ollama request; keeps the combined prompt well inside the context window
+    VIOLATION_LOG_FILE = os.path.join(output_dir, 'violations.log')
+
+    # Shared Ollama client and agents; clear what the previous run on this log file left behind
+    ollama_client, data_sanitizer, risk_analyzer, compliance_reporter = get_agents(VIOLATION_LOG_FILE)
+    data_sanitizer.clear_violation_log()
+    risk_analyzer.reset()
+    compliance_reporter.transactions = []
+    compliance_reporter.violations = []
+
+    logger.info("Loaded %d transactions.", len(raw_transactions))
 
     # Prepare for processing
-    all_sanitized_transactions = []
     all_violations = []
     
-    # Process transactions in batches
-    for i in range(0, len(raw_transactions), BATCH_SIZE):
-        batch = raw_transactions[i:i + BATCH_SIZE]
-        print(f"\n--- Processing batch {i // BATCH_SIZE + 1} ---")
+    risk_score_mapping = {
+        "Low": 1,
+        "Medium": 5,
+        "High": 10
+    }
 
-        # --- Stage 1: Data Sanitization ---
-        sanitized_batch = []
-        for idx, tx_log in enumerate(batch):
-            print(f"  [Batch {i // BATCH_SIZE + 1}] Sanitizing transaction {idx + 1}/{len(batch)}...")
-            try:
-                sanitized_log = data_sanitizer.sanitize_transaction(tx_log)
+    # Stage 1 and Stage 2 run as a pipeline: each chunk is handed to the risk pool as soon as
+    # its sanitization finishes, so both stages keep the Ollama server busy at the same time.
+    # Each chunk of LLM_BATCH_SIZE transactions is sent to the LLM as a single request.
+    chunks = [
+        range(start, min(start + LLM_BATCH_SIZE, len(raw_transactions)))
+        for start in range(0, len(raw_transactions), LLM_BATCH_SIZE)
+    ]
+    # Each chunk counts once for sanitization and once for risk analysis
+    total_steps = 2 * len(chunks)
+    steps_done = 0
+
+    def advance_progress():
+        nonlocal steps_done
+        steps_done += 1
+        if on_progress is not None:
+            on_progress(steps_done / total_steps)
+
+    sanitized_slots = [None] * len(raw_transactions)  # indexed by input position to keep input order
+    risk_futures = {}  # chunk start -> (sanitized transactions of the chunk, future)
+    with ThreadPoolExecutor(max_workers=max_workers) as risk_pool:
+
+        def handle_sanitized(chunk, chunk_logs, outcome):
+            sanitized_logs, error, elapsed = outcome
+            batch_no = chunk.start // LLM_BATCH_SIZE + 1
+            if error is not None:
+                # Continue instead of stopping
+                logger.warning("Batch %d: error during sanitization, skipping its transactions: %s", batch_no, error)
+            sanitized_chunk = []
+            for idx, tx_log, sanitized_log in zip(chunk, chunk_logs, sanitized_logs or [None] * len(chunk)):
                 if sanitized_log:
                     sanitized_tx = {
-                        "transaction_id": f"txn_{len(all_sanitized_transactions) + len(sanitized_batch) + 1}",
+                        "transaction_id": f"txn_{idx + 1}",
                         "original_log": tx_log,
                         "sanitized_log": sanitized_log,
                         "timestamp": datetime.now(timezone.utc).isoformat(), # Store as ISO format string
@@ -57,92 +165,117 @@ def run_pipeline(raw_transactions, output_dir='.'):
                         "cardholder_details": {"name": "Unknown"},
                         "merchant_details": {"name": "Unknown", "country": "Unknown"}
                     }
-                    sanitized_batch.append(sanitized_tx)
-                    print(f"  [Batch {i // BATCH_SIZE + 1}] Sanitization for transaction {idx + 1} successful.")
+                    sanitized_slots[idx] = sanitized_tx
+                    sanitized_chunk.append(sanitized_tx)
+                    logger.debug("Sanitization for transaction %d/%d successful.", idx + 1, len(raw_transactions))
                 else:
-                    print(f"  [Batch {i // BATCH_SIZE + 1}] Failed to sanitize transaction: {tx_log}")
-                    print("  Skipping transaction due to sanitization failure.") # Continue instead of stopping
-            except Exception as e:
-                print(f"  [Batch {i // BATCH_SIZE + 1}] Error during sanitization for transaction {tx_log}: {e}")
-                print("  Skipping transaction due to sanitization error.") # Continue instead of stopping
-        
-        all_sanitized_transactions.extend(sanitized_batch)
-        print(f"--- Batch {i // BATCH_SIZE + 1} sanitization complete. ---")
-
-        # --- Stage 2: Risk Analysis ---
-        risk_score_mapping = {
-            "Low": 1,
-            "Medium": 5,
-            "High": 10
-        }
-        analyzed_batch = []
-        for idx, tx in enumerate(sanitized_batch):
-            print(f"  [Batch {i // BATCH_SIZE + 1}] Analyzing risk for transaction {idx + 1}/{len(sanitized_batch)}...")
+                    # Continue instead of stopping; the raw log is not logged since it may hold a full PAN
+                    logger.debug("Failed to sanitize transaction %d; skipping it.", idx + 1)
+            logger.info("Batch %d: sanitized %d/%d in %.2fs", batch_no, len(sanitized_chunk), len(chunk), elapsed)
+            advance_progress()
+
+            # --- Stage 2: Risk Analysis ---
+            if sanitized_chunk:
+                risk_futures[chunk.start] = (
+                    sanitized_chunk,
+                    risk_pool.submit(_call_safely, risk_analyzer.analyze_risk_batch, sanitized_chunk)
+                )
+
+        # --- Stage 1: Data Sanitization ---
+        # Sanitization requests share one event loop in this thread instead of a thread each
+        chunk_inputs = [(chunk, _chunk_records(raw_transactions, chunk)) for chunk in chunks]
+        async def sanitize_all():
             try:
-                # LLM-based risk analysis
-                risk_assessment = risk_analyzer.analyze_risk_with_llm(tx)
-                if risk_assessment:
-                    risk_level_str = risk_assessment.get('risk_level', 'Low')
-                    tx['risk_score'] = risk_score_mapping.get(risk_level_str, 1)
-                    tx['risk_reasoning'] = risk_assessment.get('reasoning', '')
-                    print(f"  [Batch {i // BATCH_SIZE + 1}] Risk analysis for transaction {idx + 1} successful (LLM).")
-                else:
-                    # Fallback to rule-based if LLM fails
-                    tx['risk_score'] = risk_analyzer.calculate_risk_score(tx)
-                    tx['risk_reasoning'] = "Rule-based fallback"
-                    print(f"  [Batch {i // BATCH_SIZE + 1}] Risk analysis for transaction {idx + 1} successful (Rule-based fallback).")
-                
-                analyzed_batch.append(tx)
+                await _sanitize_chunks(data_sanitizer.sanitize_batch_async, chunk_inputs, max_workers, handle_sanitized)
+            finally:
+                # The client's connections are bound to this event loop, so close them before it ends
+                await ollama_client.aclose()
 
-            except Exception as e:
-                print(f"  [Batch {i // BATCH_SIZE + 1}] Error during risk analysis for transaction {tx.get('transaction_id')}: {e}")
+        asyncio.run(sanitize_all())
+        logger.info("--- Sanitization complete. ---")
+
+    all_sanitized_transactions = [tx for tx in sanitized_slots if tx is not None]
+
+    rule_based_fallbacks = []  # (transaction, reasoning) pairs scored together after the loop
+    for chunk_start in sorted(risk_futures):
+        sanitized_chunk, future = risk_futures[chunk_start]
+        risk_assessments, error, elapsed = future.result()
+        batch_no = chunk_start // LLM_BATCH_SIZE + 1
+        if error is not None:
+            logger.warning("Batch %d: error during risk analysis, using rule-based fallback: %s", batch_no, error)
+        llm_scored = 0
+        for tx, risk_assessment in zip(sanitized_chunk, risk_assessments or [None] * len(sanitized_chunk)):
+            if error is not None:
                 # Continue with basic scoring if Agent 2 fails
-                tx['risk_score'] = risk_analyzer.calculate_risk_score(tx)
-                tx['risk_reasoning'] = "Rule-based fallback due to error"
-                analyzed_batch.append(tx)
-                print(f"  [Batch {i // BATCH_SIZE + 1}] Risk analysis for transaction {idx + 1} completed with error (Rule-based fallback).")
-        print(f"--- Batch {i // BATCH_SIZE + 1} risk analysis complete. ---")
-    
+                rule_based_fallbacks.append((tx, "Rule-based fallback due to error"))
+            elif risk_assessment:
+                # LLM-based risk analysis
+                risk_level_str = risk_assessment.get('risk_level', 'Low')
+                tx['risk_score'] = risk_score_mapping.get(risk_level_str, 1)
+                tx['risk_reasoning'] = risk_assessment.get('reasoning', '')
+                llm_scored += 1
+                logger.debug("Risk analysis for transaction %s successful (LLM).", tx.get('transaction_id'))
+            else:
+                # Fallback to rule-based if LLM fails
+                rule_based_fallbacks.append((tx, "Rule-based fallback"))
+                logger.debug("Risk analysis for transaction %s deferred to rule-based fallback.", tx.get('transaction_id'))
+        logger.info("Batch %d: LLM risk analysis for %d/%d in %.2fs", batch_no, llm_scored, len(sanitized_chunk), elapsed)
+        advance_progress()
+
+    # Score every fallback transaction in one vectorized pass
+    if rule_based_fallbacks:
+        fallback_txs = [tx for tx, _ in rule_based_fallbacks]
+        for (tx, reasoning), score in zip(rule_based_fallbacks, risk_analyzer.score_many(fallback_txs)):
+            tx['risk_score'] = score
+            tx['risk_reasoning'] = reasoning
+    logger.info("--- Risk analysis complete. ---")
+
     # Update compliance reporter with all processed transactions
     compliance_reporter.transactions = all_sanitized_transactions
 
-    print("\n--- All batches processed ---")
+    logger.info("--- All transactions processed ---")
     
     # Load violations logged by the sanitizer
+    data_sanitizer.close()
     if os.path.exists(VIOLATION_LOG_FILE):
-        with open(VIOLATION_LOG_FILE, 'r') as f:
-            all_violations = [json.loads(line) for line in f]
+        with open(VIOLATION_LOG_FILE, 'rb') as f:
+            all_violations = [orjson.loads(line) for line in f]
         compliance_reporter.violations = all_violations
 
 
     # --- Stage 3: Compliance Reporting ---
-    print("\n--- Generating reports ---")
+    logger.info("--- Generating reports ---")
     
     reports = {}
+    report_bytes = {}  # serialized JSON reports, as written to disk, for callers that serve them
 
     summary_report = compliance_reporter.generate_daily_summary()
     reports['daily_summary'] = summary_report
-    compliance_reporter.save_as_json(summary_report, os.path.join(output_dir, "daily_summary.json"))
+    report_bytes['daily_summary'] = compliance_reporter.save_as_json(
+        summary_report, os.path.join(output_dir, "daily_summary.json"))
 
     detailed_report = compliance_reporter.generate_detailed_violation_report()
     reports['detailed_violation_report'] = detailed_report
-    compliance_reporter.save_as_json(detailed_report, os.path.join(output_dir, "detailed_violation_report.json"))
+    report_bytes['detailed_violation_report'] = compliance_reporter.save_as_json(
+        detailed_report, os.path.join(output_dir, "detailed_violation_report.json"))
     
     try:
-        print("Attempting to generate LLM-enhanced PDF report. This requires a LaTeX distribution (like MiKTeX or TeX Live) to be installed and in your system's PATH.")
+        logger.info("Attempting to generate LLM-enhanced PDF report. This requires a LaTeX distribution (like MiKTeX or TeX Live) to be installed and in your system's PATH.")
         llm_enhanced_report = compliance_reporter.generate_llm_enhanced_report()
         reports['llm_enhanced_report'] = llm_enhanced_report
-        compliance_reporter.save_as_json(llm_enhanced_report, os.path.join(output_dir, "llm_enhanced_report.json"))
+        report_bytes['llm_enhanced_report'] = compliance_reporter.save_as_json(
+            llm_enhanced_report, os.path.join(output_dir, "llm_enhanced_report.json"))
         compliance_reporter.save_as_latex_pdf(llm_enhanced_report, os.path.join(output_dir, "llm_enhanced_latex_report"))
         reports['llm_enhanced_pdf_path'] = os.path.join(output_dir, "llm_enhanced_latex_report.pdf")
     except Exception as e:
-        print(f"Could not generate LLM-enhanced report: {e}")
+        logger.error("Could not generate LLM-enhanced report: %s", e)
         reports['llm_enhanced_report_error'] = str(e)
 
-    print("\n--- Pipeline complete ---")
-    return reports, all_sanitized_transactions, all_violations
+    logger.info("--- Pipeline complete ---")
+    return reports, all_sanitized_transactions, all_violations, report_bytes
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     TRANSACTIONS_FILE = 'data/transactions.json'
     try:
         with open(TRANSACTIONS_FILE, 'r') as f:
@@ -154,10 +287,10 @@ if __name__ == '__main__':
         print(f"Error: Could not decode JSON from {TRANSACTIONS_FILE}")
         sys.exit(1)
     
-    reports, _, _ = run_pipeline(raw_transactions)
+    reports, _, _, report_bytes = run_pipeline(raw_transactions)
     print("\nGenerated Reports:")
     for key, value in reports.items():
-        if isinstance(value, dict):
-            print(f"- {key}: {len(json.dumps(value))} bytes (JSON)")
+        if key in report_bytes:
+            print(f"- {key}: {len(report_bytes[key])} bytes (JSON)")
         else:
             print(f"- {key}: {value}")
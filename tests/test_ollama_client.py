@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+from unittest import mock
+import orjson
+from utils.ollama_client import (
+    OllamaClient, _DEFAULT_SANITIZER_MODEL, _SANITIZE_BATCH_SCHEMA, _VIOLATION_SCHEMA, _local_sanitize
+)
+
+PAN = "4111111111111111"
+
+class LocalSanitizeTest(unittest.TestCase):
+    def assert_no_full_pan(self, transaction_log):
+        result = _local_sanitize(transaction_log)
+        if result is not None:
+            digits = "".join(c for c in result["sanitized_log"] if c.isdigit())
+            self.assertNotIn(PAN, digits, transaction_log)
+            self.assertTrue(result["violations"], transaction_log)
+
+    def test_masks_pan_glued_to_letters_or_underscores(self):
+        for transaction_log in (f"card{PAN}", f"ref={PAN}x", f"pan:{PAN}_tok"):
+            self.assert_no_full_pan(transaction_log)
+
+    def test_masks_pan_with_spaced_separators(self):
+        self.assert_no_full_pan("4111 - 1111 - 1111 - 1111")
+
+    def test_masks_or_defers_pan_with_punctuation_separators(self):
+        for transaction_log in ("card:4111.1111.1111.1111", "pan=4111/1111/1111/1111;amt=5", "pan:4111_1111_1111_1111"):
+            self.assert_no_full_pan(transaction_log)
+
+    def test_all_caps_name_goes_to_llm(self):
+        self.assertIsNone(_local_sanitize(f"TXN JOHN DOE {PAN}"))
+
+    def test_name_joined_by_punctuation_goes_to_llm(self):
+        self.assertIsNone(_local_sanitize(f"DOE/JOHN {PAN}"))
+        self.assertIsNone(_local_sanitize(f"{PAN}^DOE.JOHN"))
+
+    def test_unmasked_long_digit_run_goes_to_llm(self):
+        self.assertIsNone(_local_sanitize("card 4111111111111112"))
+        self.assertIsNone(_local_sanitize("ref 12345678901234567890123"))
+
+    def test_simple_log_is_sanitized_locally(self):
+        result = _local_sanitize("card 4111-1111-1111-1111 (CVV: 123), expires 12/26, for $150.00")
+        self.assertEqual(result["sanitized_log"], "card 411111******1111, expires 12/26, for $150.00")
+        self.assertEqual(
+            [violation["violation_type"] for violation in result["violations"]],
+            ["Full PAN stored", "CVV in log"]
+        )
+
+class SanitizerModelTest(unittest.TestCase):
+    def test_default_model_output_matches_schema(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("OLLAMA_SANITIZER_MODEL", None)
+            client = OllamaClient()
+        self.assertEqual(client.sanitizer_model, _DEFAULT_SANITIZER_MODEL)
+
+        response = {"results": [{
+            "sanitized_log": "card 411111******1111",
+            "violations": [{
+                "transaction_id": "N/A",
+                "violation_type": "Full PAN stored",
+                "timestamp": "2026-01-01T00:00:00+00:00",
+                "confidence_score": 0.95
+            }]
+        }]}
+        with mock.patch.object(client, "_chat_json", return_value=orjson.dumps(response).decode()) as chat_json:
+            results = client.process_transactions_batch([{"pan": PAN}])
+
+        self.assertEqual(chat_json.call_args.kwargs["model"], _DEFAULT_SANITIZER_MODEL)
+        self.assertEqual(chat_json.call_args.kwargs["format"], _SANITIZE_BATCH_SCHEMA)
+        self.assertEqual(len(results), 1)
+        for result in results:
+            self.assertIsInstance(result["sanitized_log"], str)
+            self.assertIsInstance(result["violations"], list)
+            for violation in result["violations"]:
+                self.assertLessEqual(set(_VIOLATION_SCHEMA["required"]), set(violation))
+                self.assertIsInstance(violation["confidence_score"], (int, float))
+
+    def test_env_and_argument_override_default_model(self):
+        with mock.patch.dict(os.environ, {"OLLAMA_SANITIZER_MODEL": "phi3:mini"}):
+            self.assertEqual(OllamaClient().sanitizer_model, "phi3:mini")
+            self.assertEqual(OllamaClient(sanitizer_model="qwen2.5:3b").sanitizer_model, "qwen2.5:3b")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import unittest
+from datetime import datetime, timedelta
+from agents.risk_analyzer import RiskAnalyzer
+
+def make_transactions(seed, count=200):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    transactions = [
+        {
+            "cardholder_details": {"name": rng.choice(["A", "B", "C"])},
+            "timestamp": (start + timedelta(seconds=rng.randint(0, 3600))).isoformat(),
+            "amount": rng.choice([10, 2000]),
+            "merchant_details": {"country": rng.choice(["US", "AU", "FR"])},
+        }
+        for _ in range(count)
+    ]
+    rng.shuffle(transactions)
+    return transactions
+
+def baseline_scores(analyzer, transactions):
+    """
+    Scores transactions with the original rules: a full scan of each cardholder's history.
+    """
+    rules = analyzer.risk_rules
+    history = {}
+    scores = []
+    for transaction in transactions:
+        cardholder = transaction["cardholder_details"]["name"]
+        now = datetime.fromisoformat(transaction["timestamp"])
+        history.setdefault(cardholder, []).append(now)
+        score = 0
+        if transaction["amount"] > rules["high_transaction_value"]["threshold"]:
+            score += rules["high_transaction_value"]["score"]
+        period = rules["multiple_transactions_short_period"]["period"]
+        if sum(1 for t in history[cardholder] if now - t <= period) >= rules["multiple_transactions_short_period"]["count"]:
+            score += rules["multiple_transactions_short_period"]["score"]
+        if transaction["merchant_details"]["country"] not in rules["unusual_country"]["banned_countries"]:
+            score += rules["unusual_country"]["score"]
+        scores.append(score)
+    return scores
+
+class OutOfOrderTimestampsTest(unittest.TestCase):
+    def test_sequential_and_batch_scoring_match_baseline(self):
+        for seed in range(5):
+            transactions = make_transactions(seed)
+            expected = baseline_scores(RiskAnalyzer(), transactions)
+
+            sequential = RiskAnalyzer()
+            self.assertEqual([sequential.calculate_risk_score(tx) for tx in transactions], expected)
+            self.assertEqual(RiskAnalyzer().score_many(transactions), expected)
+
+    def test_batches_continue_from_earlier_history(self):
+        transactions = make_transactions(42)
+        expected = baseline_scores(RiskAnalyzer(), transactions)
+        analyzer = RiskAnalyzer()
+        scores = []
+        for start in range(0, len(transactions), 30):
+            scores += analyzer.score_many(transactions[start:start + 30])
+        self.assertEqual(scores, expected)
+
+if __name__ == "__main__":
+    unittest.main()
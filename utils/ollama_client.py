@@ -1,14 +1,341 @@
 import ollama
+import asyncio
+import hashlib
 import json
+import logging
+import orjson
+import os
+import random
 import re
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+def _dumps(value, sort_keys=False):
+    """
+    Serializes a value for a prompt or cache key with orjson, falling back to str() for unsupported types.
+    """
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(value, default=str, option=option).decode()
+
+def _history_json(transaction_history):
+    """
+    Returns a transaction history serialized for a prompt, passing through one that already is.
+    """
+    return transaction_history if isinstance(transaction_history, str) else _dumps(transaction_history)
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so existing handlers still apply
+_loads = orjson.loads
+
+# JSON schemas passed as `format`, so the server constrains decoding to the expected shape
+_VIOLATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "transaction_id": {"type": "string"},
+        "violation_type": {"type": "string"},
+        "timestamp": {"type": "string"},
+        "confidence_score": {"type": "number"}
+    },
+    "required": ["transaction_id", "violation_type", "timestamp", "confidence_score"]
+}
+_SANITIZE_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sanitized_log": {"type": "string"},
+                    "violations": {"type": "array", "items": _VIOLATION_SCHEMA}
+                },
+                "required": ["sanitized_log", "violations"]
+            }
+        }
+    },
+    "required": ["results"]
+}
+_RISK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "risk_level": {"type": "string", "enum": ["High", "Medium", "Low"]},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["risk_level", "reasoning"]
+}
+_RISK_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {"results": {"type": "array", "items": _RISK_SCHEMA}},
+    "required": ["results"]
+}
+
+# Fixed instructions for the risk model, sent as the system message so only the transaction data varies
+_RISK_SYSTEM_PROMPT = """Analyze the transaction you are given, together with its transaction history, and provide a risk assessment in JSON format.
+Return ONLY the JSON object, with the keys "risk_level" (High, Medium or Low) and "reasoning".
+When given a numbered list of transactions, return ONLY a JSON object {"results": [...]} where "results" holds one such object per transaction, in order."""
+
+_DEFAULT_OLLAMA_HOST = "http://localhost:11434"
+# 4-bit quantized weights; sanitization is schema-constrained, so the full-precision model buys little
+_DEFAULT_SANITIZER_MODEL = "mistral:7b-instruct-q4_K_M"
+# Fail fast if the server is unreachable, but give slow generations time to finish;
+# (connect, read, write, pool) seconds, passed through to the underlying HTTP client
+_REQUEST_TIMEOUT = (2.0, 120.0, 120.0, 120.0)
+
+# Retries for requests the server turned away because it is overloaded
+_RETRY_STATUS_CODES = (429, 503)
+_MAX_ATTEMPTS = 5
+_BACKOFF_BASE = 0.1  # seconds, doubled on every retry
+_BACKOFF_JITTER = 0.05
+# Consecutive failed requests after which requests fail fast, and for how long
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN = 30.0
+
+def _backoff_delay(attempt):
+    """
+    Returns the delay before retry number `attempt` (from 0), with jitter so concurrent callers spread out.
+    """
+    return _BACKOFF_BASE * 2 ** attempt + random.uniform(0, _BACKOFF_JITTER)
+
+# Output token budgets; decode time grows with every generated token, so each endpoint is capped
+_RISK_NUM_PREDICT = 256  # per transaction
+_SANITIZE_VIOLATIONS_NUM_PREDICT = 128  # per log, on top of the sanitized log itself
+_COMPLIANCE_MAX_NUM_PREDICT = 1024
+# Structured responses are bare JSON, so a code fence means the model has wandered off.
+# (A "\n}\n" stop would be stripped from the output and cut the closing brace off the object.)
+_JSON_STOP = ["```"]
+
+# Context windows are sized per request in these steps, so the server doesn't allocate KV cache for the
+# model's full window; larger requests are rounded up to a multiple of the last one
+_NUM_CTX_BUCKETS = (512, 1024, 2048, 4096, 8192)
+_CHARS_PER_TOKEN = 4  # rough estimate for English text and JSON
+_TEMPLATE_TOKENS = 64  # chat template and role markers around the messages
+_RECENT_NUM_CTX = 2  # context windows remembered per model for reuse
+
+def _num_ctx_bucket(tokens):
+    """
+    Returns the smallest context bucket that holds `tokens`.
+    """
+    for bucket in _NUM_CTX_BUCKETS:
+        if tokens <= bucket:
+            return bucket
+    return -(-tokens // _NUM_CTX_BUCKETS[-1]) * _NUM_CTX_BUCKETS[-1]
+
+def _options(num_predict, stop=None):
+    """
+    Returns the deterministic sampling options for a request, capped at `num_predict` output tokens.
+    """
+    options = {"temperature": 0.0, "num_predict": num_predict}
+    if stop:
+        options["stop"] = stop
+    return options
+
+# Response parsing patterns, compiled once
+_FENCE_RE = re.compile(r'```(?:json)?\n(.*?)\n```', re.DOTALL)
+_RISK_RE = re.compile(r"Risk Level:\s*(High|Medium|Low)", re.IGNORECASE)
+_REASON_RE = re.compile(r"Reasoning:\s*(.*)", re.IGNORECASE | re.DOTALL)
+
+def _parse_risk_text(text):
+    """
+    Parses a plain-text "Risk Level: ... Reasoning: ..." answer into {"risk_level", "reasoning"}, or returns None.
+    """
+    risk_level_match = _RISK_RE.search(text)
+    reasoning_match = _REASON_RE.search(text)
+    if risk_level_match and reasoning_match:
+        return {
+            "risk_level": risk_level_match.group(1).strip(),
+            "reasoning": reasoning_match.group(1).strip()
+        }
+    return None
+
+# Local sanitization fast path: Luhn-valid 13-19 digit runs (optionally split by spaces or dashes) and CVV tokens.
+# PANs are not anchored on word boundaries, so one glued to letters or underscores ("card4111...") is still found.
+_PAN_RE = re.compile(r'(?<![0-9])[0-9](?:[ -]{0,3}[0-9]){12,18}(?![0-9])')
+_CVV_RE = re.compile(r'\s*\(?\bCVV[:\s]*[0-9]{3,4}\b\)?', re.IGNORECASE)
+# Left for the LLM: 13 or more digits (in any script) left unmasked with only punctuation or spaces between
+# them, which may be a card number split by dots, slashes or underscores; two letter runs joined by spaces or
+# punctuation in any case, which may be a cardholder name ("JOHN DOE", "DOE/JOHN"); and other security-code
+# mentions
+_UNMASKED_DIGITS_RE = re.compile(r'\d(?:[\W_]*\d){12,}')
+_NEEDS_LLM_RE = re.compile(r'[^\W\d_]+[\W_]+[^\W\d_]+|name|cardholder|cvc|cvv|cid|security', re.IGNORECASE)
+
+def _luhn_valid(digits):
+    """
+    Returns True if a digit string passes the Luhn checksum.
+    """
+    total = 0
+    for i, digit in enumerate(map(int, reversed(digits))):
+        if i % 2:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return total % 10 == 0
+
+def _local_sanitize(transaction_log):
+    """
+    Sanitizes a plain-text log without the LLM: masks Luhn-valid PANs (first 6 and last 4 digits kept) and
+    removes CVV tokens. Returns {"sanitized_log", "violations"}, or None if the log needs the LLM.
+    """
+    if not isinstance(transaction_log, str):
+        return None
+    violation_types = []
+
+    def mask(match):
+        digits = match.group(0).replace(" ", "").replace("-", "")
+        if not _luhn_valid(digits):
+            return match.group(0)
+        if "Full PAN stored" not in violation_types:
+            violation_types.append("Full PAN stored")
+        return f"{digits[:6]}{'*' * (len(digits) - 10)}{digits[-4:]}"
+
+    sanitized_log = _PAN_RE.sub(mask, transaction_log)
+    sanitized_log, cvv_count = _CVV_RE.subn("", sanitized_log)
+    if cvv_count:
+        violation_types.append("CVV in log")
+    if _UNMASKED_DIGITS_RE.search(sanitized_log) or _NEEDS_LLM_RE.search(sanitized_log):
+        return None
+
+    timestamp = datetime.now(timezone.utc).isoformat()
+    return {
+        "sanitized_log": sanitized_log,
+        "violations": [
+            {"transaction_id": "N/A", "violation_type": violation_type, "timestamp": timestamp, "confidence_score": 1.0}
+            for violation_type in violation_types
+        ]
+    }
+
+class _JsonObjectScanner:
+    """
+    Tracks brace depth across streamed chunks, ignoring braces inside JSON strings, to tell when the
+    first top-level JSON object in a response is complete.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        """
+        Scans the next chunk. Returns the offset just past the closing brace of the first object if
+        it ends in this chunk, otherwise None.
+        """
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                # Quotes outside an object (e.g. in leading prose) don't start a JSON string
+                self.in_string = self.depth > 0
+            elif char == '{':
+                self.depth += 1
+            elif char == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return None
+
+def _extract_first_json_object(text):
+    """
+    Returns the first balanced {...} in text, or None. Unlike slicing from the first '{' to the last '}',
+    this isn't thrown off by text or further objects after the first one.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    end = _JsonObjectScanner().feed(text[start:])
+    return text[start:start + end] if end is not None else None
+
+def _json_candidates(text):
+    """
+    Yields the places a JSON answer may be in a response, cheapest first: the whole text, the first
+    fenced code block, then the first balanced {...}. Later ones are only computed if asked for.
+    """
+    yield text
+    fence_match = _FENCE_RE.search(text)
+    if fence_match:
+        yield fence_match.group(1).strip()
+    json_string = _extract_first_json_object(text)
+    if json_string is not None:
+        yield json_string
+
+def _cache_key(value):
+    """
+    Returns a short digest of a log or violation; dicts are canonicalized first so key order doesn't matter.
+    """
+    text = value if isinstance(value, str) else _dumps(value, sort_keys=True)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+class _TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after being stored.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expiry, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+class _CircuitOpenError(RuntimeError):
+    """
+    Raised instead of sending a request while the circuit breaker is open.
+    """
+
+class _CircuitBreaker:
+    """
+    Thread-safe circuit breaker: after `threshold` consecutive failed requests, check() raises
+    _CircuitOpenError for `cooldown` seconds so callers stop piling requests onto a struggling server.
+    """
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        if time.monotonic() < self._open_until:
+            raise _CircuitOpenError("Ollama circuit breaker is open after repeated failures")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self._failures = 0
 
 class OllamaClient:
-    def __init__(self, sanitizer_model="mistral:7b-instruct", risk_model="sentinel-risk-analyzer", compliance_model="sentinel-compliance-explainer"):
-        self.sanitizer_model = sanitizer_model
-        self.risk_model = risk_model
-        self.compliance_model = compliance_model
-        self.system_prompt = """You are a PCI-DSS compliance expert. Your task is to analyze a given transaction log and return a JSON object with two keys: "sanitized_log" and "violations".
+    # Sent verbatim as the first (system) message of every sanitization request; the server reuses its
+    # prefilled tokens across requests. Changing it, or interpolating anything into it, invalidates that prefix.
+    SYSTEM_PROMPT = """You are a PCI-DSS compliance expert. Your task is to analyze a given transaction log and return a JSON object with two keys: "sanitized_log" and "violations".
 
 - "sanitized_log": The sanitized version of the log, with PANs masked (first 6 and last 4 digits visible), CVVs removed, and cardholder names partially masked.
 - "violations": A list of any PCI-DSS violations found in the original log. Each violation should be a JSON object with the following keys:
@@ -38,154 +365,517 @@ Example Output:
 }
 """
 
+    def __init__(self, sanitizer_model=None, risk_model="sentinel-risk-analyzer", compliance_model="sentinel-compliance-explainer",
+                 cache_size=4096, cache_ttl=3600.0, keep_alive="24h", host=None):
+        # Defaults to OLLAMA_SANITIZER_MODEL, then a quantized Mistral 7B
+        self.sanitizer_model = sanitizer_model or os.environ.get("OLLAMA_SANITIZER_MODEL", _DEFAULT_SANITIZER_MODEL)
+        self.risk_model = risk_model
+        self.compliance_model = compliance_model
+        # Keeps the models loaded between requests, so the server can reuse the cached system prompt prefix
+        self.keep_alive = keep_alive
+        # Successful sanitization results and explanations, so repeated inputs skip the LLM
+        self._sanitize_cache = _TTLCache(cache_size, cache_ttl)
+        self._explanation_cache = _TTLCache(cache_size, cache_ttl)
+        # One persistent client, so every request reuses its pooled HTTP connections
+        self.host = host or os.environ.get("OLLAMA_HOST", _DEFAULT_OLLAMA_HOST)
+        self._client = ollama.Client(host=self.host, timeout=_REQUEST_TIMEOUT)
+        # Shared by every request, sync and async
+        self._breaker = _CircuitBreaker(_BREAKER_THRESHOLD, _BREAKER_COOLDOWN)
+        # Context windows recently sent per model, least recent first; see _with_num_ctx
+        self._num_ctx = {}
+        self._num_ctx_lock = threading.Lock()
+        # Created lazily by _get_async_client, one per event loop; the client may be shared across threads
+        self._async_clients = {}
+        self._async_lock = threading.Lock()
+
     def process_transaction(self, transaction_log):
         """
         Sends a transaction log to the Ollama model for analysis and sanitization,
-        expecting a JSON response.
+        expecting a JSON response. Thin wrapper over process_transactions_batch.
+        """
+        results = self.process_transactions_batch([transaction_log])
+        return results[0] if results else None
+
+    def process_transactions_batch(self, transaction_logs, batch_size=8):
+        """
+        Sanitizes transaction logs with one Ollama request per `batch_size` logs, amortizing the system
+        prompt and round trip over each batch. Returns one {"sanitized_log", "violations"} dict per log in
+        input order, or None if a request failed or a response doesn't match its inputs.
+        Logs seen recently are answered from the cache and left out of the requests.
+        """
+        keys, results, missing = self._lookup_sanitized(transaction_logs)
+        for batch in self._split_batches(missing, batch_size):
+            try:
+                content = self._chat_json(
+                    model=self.sanitizer_model,
+                    messages=self._batch_sanitize_messages([transaction_logs[i] for i in batch]),
+                    format=_SANITIZE_BATCH_SCHEMA,
+                    keep_alive=self.keep_alive,
+                    options=self._sanitize_options([transaction_logs[i] for i in batch])
+                )
+            except Exception as e:
+                logger.warning("An error occurred while communicating with Ollama: %s", e)
+                return None
+            if not self._store_sanitized(content, batch, keys, results):
+                return None
+        return results
+
+    async def a_process_transaction(self, transaction_log):
+        """
+        Async counterpart of process_transaction.
+        """
+        results = await self.a_process_transactions_batch([transaction_log])
+        return results[0] if results else None
+
+    def process_many(self, transaction_logs, max_in_flight=16):
+        """
+        Sanitizes logs one request each, with up to `max_in_flight` requests open at once so the server
+        can batch them. Returns results in input order (None for failed logs).
+        Must not be called from a running event loop.
+        """
+        async def run_all():
+            semaphore = asyncio.Semaphore(max_in_flight)
+
+            async def run(log):
+                async with semaphore:
+                    return await self.a_process_transaction(log)
+
+            try:
+                return await asyncio.gather(*(run(log) for log in transaction_logs))
+            finally:
+                await self.aclose()
+
+        return asyncio.run(run_all())
+
+    async def a_process_transactions_batch(self, transaction_logs, batch_size=8):
+        """
+        Async counterpart of process_transactions_batch, sent through an ollama.AsyncClient so many
+        batches can be in flight on one event loop.
+        """
+        keys, results, missing = self._lookup_sanitized(transaction_logs)
+        for batch in self._split_batches(missing, batch_size):
+            try:
+                content = await self._a_chat_json(
+                    model=self.sanitizer_model,
+                    messages=self._batch_sanitize_messages([transaction_logs[i] for i in batch]),
+                    format=_SANITIZE_BATCH_SCHEMA,
+                    keep_alive=self.keep_alive,
+                    options=self._sanitize_options([transaction_logs[i] for i in batch])
+                )
+            except Exception as e:
+                logger.warning("An error occurred while communicating with Ollama: %s", e)
+                return None
+            if not self._store_sanitized(content, batch, keys, results):
+                return None
+        return results
+
+    def _lookup_sanitized(self, transaction_logs):
+        """
+        Returns (cache keys, results with cached and locally sanitized entries filled in, positions still to request).
+        """
+        keys = [_cache_key(log) for log in transaction_logs]
+        results = [self._sanitize_cache.get(key) or _local_sanitize(log) for key, log in zip(keys, transaction_logs)]
+        missing = [i for i, result in enumerate(results) if result is None]
+        return keys, results, missing
+
+    def _store_sanitized(self, response_content, batch, keys, results):
+        """
+        Parses the response for the logs at positions `batch` into `results` and caches them.
+        Returns False if the response doesn't match the batch.
+        """
+        batch_results = self._parse_batch_sanitize_response(response_content, len(batch))
+        if batch_results is None:
+            return False
+        for i, result in zip(batch, batch_results):
+            results[i] = result
+            self._sanitize_cache.put(keys[i], result)
+        return True
+
+    @staticmethod
+    def _split_batches(items, batch_size):
+        """
+        Splits items into consecutive lists of at most batch_size. Past a few items per request the
+        prompt grows faster than the per-request overhead saved, so batches are kept small.
+        """
+        return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def _get_async_client(self):
+        """
+        Returns the AsyncClient for the running event loop. Its connection pool is bound to the loop
+        it was created on, so each loop gets its own client; close it with aclose().
+        """
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            # Clients of loops that ended without aclose() can no longer be closed; just drop them
+            for stale_loop in [other for other in self._async_clients if other.is_closed()]:
+                del self._async_clients[stale_loop]
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = ollama.AsyncClient(host=self.host, timeout=_REQUEST_TIMEOUT)
+        return client
+
+    async def aclose(self):
+        """
+        Closes the AsyncClient of the running event loop, if any. Call it before the loop ends, since the
+        client's connections can't be closed afterwards; the next async call creates a new client.
+        """
+        with self._async_lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def _with_num_ctx(self, request):
+        """
+        Returns the chat request with options["num_ctx"] sized to its own prompt plus output budget, rounded
+        up to a bucket. Ollama reloads a model whenever num_ctx changes, so a bucket the model used recently
+        is reused instead when it is at most one step larger than needed.
+        """
+        options = request["options"]
+        prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // _CHARS_PER_TOKEN
+        bucket = _num_ctx_bucket(prompt_tokens + _TEMPLATE_TOKENS + options["num_predict"])
+        with self._num_ctx_lock:
+            recent = self._num_ctx.setdefault(request["model"], OrderedDict())
+            reusable = [size for size in recent if bucket <= size <= 2 * bucket]
+            if reusable:
+                bucket = min(reusable)
+            recent[bucket] = None
+            recent.move_to_end(bucket)
+            if len(recent) > _RECENT_NUM_CTX:
+                recent.popitem(last=False)
+        return {**request, "options": {**options, "num_ctx": bucket}}
+
+    def _call_llm(self, request):
+        """
+        Runs request(), retrying with exponential backoff and jitter while the server reports it is
+        overloaded (HTTP 429/503). Fails fast with _CircuitOpenError while the circuit breaker is open.
         """
+        self._breaker.check()
         try:
-            response = ollama.chat(
-                model=self.sanitizer_model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": f"Sanitize and analyze the following transaction log: {transaction_log}"}
-                ],
-                options={"temperature": 0.0} # Lower temperature for more deterministic output
-            )
-            
-            response_content = response['message']['content']
-
-            # Find all content within ``` backticks
-            matches = re.findall(r'```(?:json)?\n(.*?)\n```', response_content, re.DOTALL)
-
-            sanitized_log = ""
-            violations = []
-
-            if matches:
-                # The first match should be the sanitized log
-                sanitized_log = matches[0].strip()
-                # The second match should be the violations
-                if len(matches) > 1:
-                    try:
-                        violations = json.loads(matches[1])
-                    except json.JSONDecodeError:
-                        print("Could not parse violations JSON")
-                        pass # Keep violations as empty list
-
-            # If no backticks found, try to find a JSON object directly
-            else:
-                json_start = response_content.find('{')
-                json_end = response_content.rfind('}') + 1
-                if json_start != -1 and json_end != -1:
-                    json_string = response_content[json_start:json_end]
-                    try:
-                        data = json.loads(json_string)
-                        sanitized_log = data.get("sanitized_log", "")
-                        violations = data.get("violations", [])
-                    except json.JSONDecodeError:
-                        pass # Keep sanitized_log and violations as empty
-
-            return {
-                "sanitized_log": sanitized_log,
-                "violations": violations
-            }
+            for attempt in range(_MAX_ATTEMPTS):
+                try:
+                    result = request()
+                    break
+                except ollama.ResponseError as e:
+                    if e.status_code not in _RETRY_STATUS_CODES or attempt == _MAX_ATTEMPTS - 1:
+                        raise
+                time.sleep(_backoff_delay(attempt))
+        except Exception:
+            self._breaker.record_failure()
+            raise
+        self._breaker.record_success()
+        return result
+
+    async def _a_call_llm(self, request):
+        """
+        Async counterpart of _call_llm; request() returns an awaitable.
+        """
+        self._breaker.check()
+        try:
+            for attempt in range(_MAX_ATTEMPTS):
+                try:
+                    result = await request()
+                    break
+                except ollama.ResponseError as e:
+                    if e.status_code not in _RETRY_STATUS_CODES or attempt == _MAX_ATTEMPTS - 1:
+                        raise
+                await asyncio.sleep(_backoff_delay(attempt))
+        except Exception:
+            self._breaker.record_failure()
+            raise
+        self._breaker.record_success()
+        return result
+
+    def _chat_json(self, **request):
+        """
+        Streams a chat response and stops reading once the first JSON object in it is complete, so the
+        caller doesn't wait for any text the model adds after it. Returns the content up to that point.
+        """
+        request = self._with_num_ctx(request)
+
+        def read():
+            scanner = _JsonObjectScanner()
+            parts = []
+            stream = self._client.chat(stream=True, **request)
+            try:
+                for chunk in stream:
+                    text = chunk['message']['content']
+                    end = scanner.feed(text)
+                    if end is not None:
+                        parts.append(text[:end])
+                        break
+                    parts.append(text)
+            finally:
+                # Closing the stream early drops the connection, which ends generation on the server
+                stream.close()
+            return "".join(parts)
+
+        return self._call_llm(read)
+
+    async def _a_chat_json(self, **request):
+        """
+        Async counterpart of _chat_json.
+        """
+        request = self._with_num_ctx(request)
+
+        async def read():
+            scanner = _JsonObjectScanner()
+            parts = []
+            stream = await self._get_async_client().chat(stream=True, **request)
+            try:
+                async for chunk in stream:
+                    text = chunk['message']['content']
+                    end = scanner.feed(text)
+                    if end is not None:
+                        parts.append(text[:end])
+                        break
+                    parts.append(text)
+            finally:
+                await stream.aclose()
+            return "".join(parts)
+
+        return await self._a_call_llm(read)
+
+    def _batch_sanitize_messages(self, transaction_logs):
+        """
+        Builds the chat messages for a batched sanitization request.
+        """
+        numbered_logs = "\n".join(f"{i}) {log}" for i, log in enumerate(transaction_logs, 1))
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": (
+                f"Sanitize and analyze each of the following {len(transaction_logs)} transaction logs. "
+                'Return a JSON object {"results": [...]} where "results" holds one object per log, in order, '
+                f'each with the keys "sanitized_log" and "violations".\n{numbered_logs}'
+            )}
+        ]
+
+    @staticmethod
+    def _sanitize_options(transaction_logs):
+        """
+        Sampling options for a batched sanitization request. Each sanitized log is about as long as its
+        input, so the budget is twice the input's estimated token count plus room for the violations.
+        """
+        num_predict = sum(
+            2 * len(str(log)) // _CHARS_PER_TOKEN + _SANITIZE_VIOLATIONS_NUM_PREDICT for log in transaction_logs
+        )
+        return _options(num_predict, _JSON_STOP)
 
+    def _parse_batch_sanitize_response(self, response_content, expected_count):
+        """
+        Extracts the per-log results from a batched sanitization response, or returns None if they
+        can't be matched to the inputs.
+        """
+        try:
+            results = _loads(response_content).get("results")
         except Exception as e:
-            print(f"An error occurred while communicating with Ollama: {e}")
+            logger.warning("Could not parse the batch response: %s", e)
+            return None
+
+        if not isinstance(results, list) or len(results) != expected_count \
+                or not all(isinstance(result, dict) for result in results):
+            logger.warning("Could not match the batch response to the transaction logs")
             return None
+        return [
+            {"sanitized_log": result.get("sanitized_log", ""), "violations": result.get("violations", [])}
+            for result in results
+        ]
 
     def analyze_risk(self, transaction, transaction_history):
         """
         Sends a transaction and its history to the Ollama model for risk analysis.
         """
-        prompt = f"""
-Analyze the following transaction and provide a risk assessment in JSON format.
+        return self.analyze_risk_with_prepared_history(transaction, _dumps(transaction_history))
 
-Transaction: {json.dumps(transaction, default=str)}
-Transaction History: {json.dumps(transaction_history, default=str)}
+    def analyze_risk_with_prepared_history(self, transaction, history_json):
+        """
+        Like analyze_risk, but takes the history already serialized with serialize_history, so callers assessing
+        several transactions against the same history serialize it once.
+        """
+        try:
+            response_content = self._chat_json(
+                model=self.risk_model,
+                messages=self._risk_messages(_dumps(transaction), history_json),
+                format=_RISK_SCHEMA,
+                keep_alive=self.keep_alive,
+                options=_options(_RISK_NUM_PREDICT, _JSON_STOP)
+            )
+            return self._parse_risk_response(response_content)
+        except Exception as e:
+            logger.warning("An error occurred during risk analysis with Ollama: %s", e)
+            return None
 
-Return ONLY the JSON object.
-"""
+    async def a_analyze_risk(self, transaction, transaction_history):
+        """
+        Async counterpart of analyze_risk. The history may also be passed already serialized.
+        """
+        try:
+            response_content = await self._a_chat_json(
+                model=self.risk_model,
+                messages=self._risk_messages(_dumps(transaction), _history_json(transaction_history)),
+                format=_RISK_SCHEMA,
+                keep_alive=self.keep_alive,
+                options=_options(_RISK_NUM_PREDICT, _JSON_STOP)
+            )
+            return self._parse_risk_response(response_content)
+        except Exception as e:
+            logger.warning("An error occurred during risk analysis with Ollama: %s", e)
+            return None
+
+    def _risk_messages(self, transaction_json, history_json):
+        """
+        Builds the chat messages for a single-transaction risk assessment.
+        """
+        return [
+            {"role": "system", "content": _RISK_SYSTEM_PROMPT},
+            {"role": "user", "content": self._build_prompt(transaction_json, history_json)}
+        ]
+
+    @staticmethod
+    def serialize_history(transaction_history):
+        """
+        Serializes a transaction history the way the risk prompts embed it, for analyze_risk_with_prepared_history
+        and analyze_risk_batch.
+        """
+        return _dumps(transaction_history)
+
+    @staticmethod
+    def _build_prompt(transaction_json, history_json):
+        """
+        Builds the user prompt for a risk assessment from an already serialized transaction and history.
+        """
+        return f"Transaction: {transaction_json}\nTransaction History: {history_json}"
+
+    def _parse_risk_response(self, response_content):
+        """
+        Extracts {"risk_level", "reasoning"} from a risk model response, or returns None.
+        """
+        logger.debug("LLM risk analysis response: %s", response_content)
+
+        # Requests are constrained to _RISK_SCHEMA, so the content should be the JSON object itself.
+        # Legacy models that ignore the format constraint may wrap it in a code fence or in prose.
+        for json_string in _json_candidates(response_content):
+            try:
+                assessment = _loads(json_string)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(assessment, dict) and "risk_level" in assessment:
+                return assessment
+
+        # No usable JSON object: scrape a plain-text "Risk Level: ... Reasoning: ..." answer
+        assessment = _parse_risk_text(response_content)
+        if assessment is None:
+            logger.warning("Could not parse risk level and reasoning from the response.")
+        return assessment
+
+    def analyze_risk_batch(self, transactions, transaction_histories):
+        """
+        Assesses the risk of several transactions with a single Ollama request. Each history is a list
+        of past transactions or, if shared between transactions, that list already serialized with serialize_history.
+        Returns one {"risk_level", "reasoning"} dict per transaction in input order, or None if the
+        request failed or the response doesn't match the inputs.
+        """
+        numbered_transactions = "\n".join(
+            f"{i}) Transaction: {_dumps(transaction)}\n"
+            f"   Transaction History: {_history_json(history)}"
+            for i, (transaction, history) in enumerate(zip(transactions, transaction_histories), 1)
+        )
+        prompt = f"Assess each of the following {len(transactions)} transactions.\n\n{numbered_transactions}"
         try:
-            response = ollama.chat(
+            response_content = self._chat_json(
                 model=self.risk_model,
                 messages=[
+                    {"role": "system", "content": _RISK_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
-                options={"temperature": 0.0}
+                format=_RISK_BATCH_SCHEMA,
+                keep_alive=self.keep_alive,
+                options=_options(_RISK_NUM_PREDICT * len(transactions), _JSON_STOP)
             )
-            response_content = response['message']['content']
-            print("--- LLM Risk Analysis Response ---")
-            print(response_content)
-            print("---------------------------------")
-
-            try:
-                # First, try to find and parse a JSON object
-                matches = re.findall(r'```(?:json)?\n(.*?)\n```', response_content, re.DOTALL)
-                if matches:
-                    json_string = matches[0].strip()
-                    return json.loads(json_string)
-
-                json_start = response_content.find('{')
-                json_end = response_content.rfind('}') + 1
-                if json_start != -1 and json_end != -1:
-                    json_string = response_content[json_start:json_end]
-                    return json.loads(json_string)
-
-                # If no JSON object is found, fall back to regex for text parsing
-                risk_level_match = re.search(r"Risk Level:\s*(High|Medium|Low)", response_content, re.IGNORECASE)
-                reasoning_match = re.search(r"Reasoning:\s*(.*)", response_content, re.IGNORECASE | re.DOTALL)
-
-                if risk_level_match and reasoning_match:
-                    risk_level = risk_level_match.group(1).strip()
-                    reasoning = reasoning_match.group(1).strip()
-                    
-                    return {
-                        "risk_level": risk_level,
-                        "reasoning": reasoning
-                    }
-                else:
-                    print("Error: Could not parse risk level and reasoning from the response.")
-                    return None
-            except (json.JSONDecodeError, IndexError) as e:
-                print(f"An error occurred during response parsing: {e}")
-                # Fallback to regex if JSON parsing fails
-                risk_level_match = re.search(r"Risk Level:\s*(High|Medium|Low)", response_content, re.IGNORECASE)
-                reasoning_match = re.search(r"Reasoning:\s*(.*)", response_content, re.IGNORECASE | re.DOTALL)
-
-                if risk_level_match and reasoning_match:
-                    risk_level = risk_level_match.group(1).strip()
-                    reasoning = reasoning_match.group(1).strip()
-                    
-                    return {
-                        "risk_level": risk_level,
-                        "reasoning": reasoning
-                    }
-                else:
-                    print("Error: Could not parse risk level and reasoning from the response on fallback.")
-                    return None
+            results = _loads(response_content).get("results")
         except Exception as e:
-            print(f"An error occurred during risk analysis with Ollama: {e}")
+            logger.warning("An error occurred during risk analysis with Ollama: %s", e)
             return None
 
+        if not isinstance(results, list) or len(results) != len(transactions) \
+                or not all(isinstance(result, dict) for result in results):
+            logger.warning("Could not match the batch risk response to the transactions")
+            return None
+        return results
+
     def generate_compliance_explanation(self, violation):
         """
         Generates a human-readable explanation for a compliance violation.
+        Explanations are cached by the violation's content.
         """
-        prompt = f"Violation Details: {json.dumps(violation, default=str)}"
+        key = _cache_key(violation)
+        explanation = self._explanation_cache.get(key)
+        if explanation is not None:
+            return explanation
         try:
-            response = ollama.chat(
+            request = self._with_num_ctx(dict(
                 model=self.compliance_model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                options={"temperature": 0.0}
-            )
-            return response['message']['content']
+                messages=self._compliance_messages(violation),
+                keep_alive=self.keep_alive,
+                options=self._compliance_options(violation)
+            ))
+            response = self._call_llm(lambda: self._client.chat(**request))
+            explanation = response['message']['content']
+            self._explanation_cache.put(key, explanation)
+            return explanation
+        except Exception as e:
+            logger.warning("An error occurred during compliance explanation generation with Ollama: %s", e)
+            return None
+
+    async def a_generate_compliance_explanation(self, violation):
+        """
+        Async counterpart of generate_compliance_explanation.
+        """
+        key = _cache_key(violation)
+        explanation = self._explanation_cache.get(key)
+        if explanation is not None:
+            return explanation
+        try:
+            request = self._with_num_ctx(dict(
+                model=self.compliance_model,
+                messages=self._compliance_messages(violation),
+                keep_alive=self.keep_alive,
+                options=self._compliance_options(violation)
+            ))
+            response = await self._a_call_llm(lambda: self._get_async_client().chat(**request))
+            explanation = response['message']['content']
+            self._explanation_cache.put(key, explanation)
+            return explanation
         except Exception as e:
-            print(f"An error occurred during compliance explanation generation with Ollama: {e}")
+            logger.warning("An error occurred during compliance explanation generation with Ollama: %s", e)
             return None
 
+    async def analyze_transaction(self, transaction_log, transaction, transaction_history):
+        """
+        Sanitizes a log and assesses its transaction's risk concurrently, then explains each violation found,
+        also concurrently. Returns {"sanitized", "risk_assessment", "explanations"}; "sanitized" and
+        "risk_assessment" are None if their request failed.
+        """
+        sanitized, risk_assessment = await asyncio.gather(
+            self.a_process_transaction(transaction_log),
+            self.a_analyze_risk(transaction, transaction_history)
+        )
+        violations = sanitized.get("violations", []) if sanitized else []
+        explanations = await asyncio.gather(*(self.a_generate_compliance_explanation(v) for v in violations))
+        return {"sanitized": sanitized, "risk_assessment": risk_assessment, "explanations": list(explanations)}
+
+    def _compliance_messages(self, violation):
+        """
+        Builds the chat messages for a compliance explanation.
+        """
+        return [{"role": "user", "content": f"Violation Details: {_dumps(violation)}"}]
+
+    @staticmethod
+    def _compliance_options(violation):
+        """
+        Sampling options for a compliance explanation; the budget scales with the size of the violation.
+        """
+        return _options(min(_COMPLIANCE_MAX_NUM_PREDICT, 4 + 4 * len(str(violation))))
+
 if __name__ == '__main__':
     ollama_client = OllamaClient()
     